@@ -21,8 +21,12 @@ if config.config_file_name is not None:
 #target_metadata = None
 from app.models import *
 from app.database import Base
+from app.config import Config
 target_metadata = Base.metadata
 
+# same DSN as the app (DATABASE_URI / POSTGRES_* env), % escaped for configparser
+config.set_main_option('sqlalchemy.url', Config.DATABASE_URI.replace('%', '%%'))
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -0,0 +1,31 @@
+"""item-source-data-gin
+
+Revision ID: 4c1f0e9a7b21
+Revises: ebb722ee07b5
+Create Date: 2026-10-19 10:03:47.118254
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4c1f0e9a7b21'
+down_revision: Union[str, Sequence[str], None] = 'ebb722ee07b5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index('ix_item_source_data', 'item', ['source_data'], unique=False, postgresql_using='gin', postgresql_ops={'source_data': 'jsonb_path_ops'}, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_item_source_data', table_name='item', postgresql_concurrently=True)
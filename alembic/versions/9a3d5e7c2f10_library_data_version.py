@@ -0,0 +1,28 @@
+"""library-data-version
+
+Revision ID: 9a3d5e7c2f10
+Revises: 4c1f0e9a7b21
+Create Date: 2026-10-19 11:24:09.530871
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9a3d5e7c2f10'
+down_revision: Union[str, Sequence[str], None] = '4c1f0e9a7b21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('library', sa.Column('data_version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('library', 'data_version')
@@ -0,0 +1,34 @@
+"""item-search-doc
+
+Revision ID: b7e41c9d3a62
+Revises: 9a3d5e7c2f10
+Create Date: 2026-10-19 13:02:51.774310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e41c9d3a62'
+down_revision: Union[str, Sequence[str], None] = '9a3d5e7c2f10'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # filled by `flask searchindex` (all libraries) after upgrading, then on every import
+    op.add_column('item', sa.Column('search_doc', postgresql.TSVECTOR(), nullable=True))
+    with op.get_context().autocommit_block():
+        op.create_index('ix_item_search_doc', 'item', ['search_doc'], unique=False, postgresql_using='gin', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_item_search_doc', table_name='item', postgresql_concurrently=True)
+    op.drop_column('item', 'search_doc')
@@ -0,0 +1,42 @@
+"""collection-path
+
+Revision ID: c2a8f6d1e953
+Revises: b7e41c9d3a62
+Create Date: 2026-10-19 14:11:37.208416
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c2a8f6d1e953'
+down_revision: Union[str, Sequence[str], None] = 'b7e41c9d3a62'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('collection', sa.Column('path', sa.String(length=500, collation='C'), nullable=True))
+    # same as app.helpers.collection.make_collection_paths_stmt, all libraries
+    op.execute("""
+        UPDATE collection SET path = p.path
+        FROM (
+            SELECT descendant_id, '/' || string_agg(ancestor_id::text, '/' ORDER BY depth DESC) || '/' AS path
+            FROM collection_closure
+            GROUP BY descendant_id
+        ) p
+        WHERE collection.id = p.descendant_id
+    """)
+    with op.get_context().autocommit_block():
+        op.create_index('ix_collection_path', 'collection', ['path'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_collection_path', table_name='collection', postgresql_concurrently=True)
+    op.drop_column('collection', 'path')
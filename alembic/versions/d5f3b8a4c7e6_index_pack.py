@@ -0,0 +1,44 @@
+"""index-pack
+
+Revision ID: d5f3b8a4c7e6
+Revises: c2a8f6d1e953
+Create Date: 2026-10-19 15:26:04.913572
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5f3b8a4c7e6'
+down_revision: Union[str, Sequence[str], None] = 'c2a8f6d1e953'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# name, table, columns
+INDEXES = [
+    ('ix_collection_closure_descendant_depth', 'collection_closure', ['descendant_id', 'depth']),
+    ('ix_collection_item_collection_id', 'collection_item', ['collection_id']),
+    ('ix_collection_item_item_id', 'collection_item', ['item_id']),
+    ('ix_item_data_item_field', 'item_data', ['item_id', 'field_id']),
+    ('ix_item_library_name', 'item', ['library_id', 'name']),
+    ('ix_item_note_item_id', 'item_note', ['item_id']),
+    ('ix_item_attachment_item_id', 'item_attachment', ['item_id']),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY can't run inside a transaction
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, unique=False, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,43 @@
+"""item-is-visible
+
+Revision ID: e8a1c4f7b2d9
+Revises: d5f3b8a4c7e6
+Create Date: 2026-10-19 16:02:37.184220
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8a1c4f7b2d9'
+down_revision: Union[str, Sequence[str], None] = 'd5f3b8a4c7e6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('item', sa.Column('is_visible', sa.Boolean(), server_default=sa.true(), nullable=False))
+    # the former hard-coded rule of library 1: item_data field 1 = '1'
+    op.execute("""
+        UPDATE item SET is_visible = EXISTS (
+            SELECT 1 FROM item_data
+            WHERE item_data.item_id = item.id AND item_data.field_id = 1 AND item_data.value = '1'
+        )
+        WHERE item.library_id = 1
+    """)
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_item_visible_library_name', 'item', ['library_id', 'name'], unique=False,
+            postgresql_where=sa.text('is_visible'), postgresql_concurrently=True, if_not_exists=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_item_visible_library_name', table_name='item', postgresql_concurrently=True, if_exists=True)
+    op.drop_column('item', 'is_visible')
@@ -0,0 +1,29 @@
+"""attachment-derivatives
+
+Revision ID: f3b9d2e6a8c1
+Revises: e8a1c4f7b2d9
+Create Date: 2026-10-19 16:48:12.530914
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b9d2e6a8c1'
+down_revision: Union[str, Sequence[str], None] = 'e8a1c4f7b2d9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('item_attachment', sa.Column('derivatives', postgresql.JSONB(astext_type=sa.Text()), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('item_attachment', 'derivatives')
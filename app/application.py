@@ -27,8 +27,15 @@ from flask import (
 # from babel.support import Translations
 #from flask_jwt_extended import JWTManager
 
-#from app.database import init_db
-from app.database import session
+from app.database import (
+    session,
+    init_db,
+    get_pool_stats,
+)
+from app.config import get_config_object
+from app.helpers.bbcode import bbcode_to_html
+from app.helpers.item import attachment_url
+from app.helpers.json_provider import FastJSONProvider
 
 #from app.models.site import (
 #    User,
@@ -82,71 +89,28 @@ def apply_blueprints(app):
     #app.register_blueprint(admin_bp, url_prefix='/admin')
     #app.register_blueprint(api_bp, url_prefix='/api/v1')
 
-## nc: specific
-def bbcode_to_html(text, storage_url='https://f001.backblazeb2.com/file/nc-media/'):
-    """Convert BBCode to HTML for display.
-
-    Args:
-        text: BBCode text to convert
-        storage_url: Base URL for media storage (from library config)
-    """
-    if not text:
-        return ''
-
-    # Font size mapping (BBCode size to actual CSS size)
-    def convert_size(match):
-        size = int(match.group(1))
-        # Map BBCode sizes to reasonable CSS sizes
-        size_map = {
-            1: '0.8em',
-            2: '0.9em',
-            3: '1em',
-            4: '1.2em',
-            5: '1.5em',
-            6: '1.8em',
-            7: '2em',
-        }
-        css_size = size_map.get(size, f'{size * 0.2}em')
-        content = match.group(2)
-        return f'<span style="font-size: {css_size}">{content}</span>'
-
-    # Replace BBCode tags with HTML (order matters!)
-    replacements = [
-        # URL with text (must be before plain URL)
-        (re.compile(r'\[URL="?(.*?)"?\](.*?)\[/URL\]', re.IGNORECASE | re.DOTALL), r'<a href="\1" target="_blank">\2</a>'),
-        # URL without text
-        (re.compile(r'\[URL\](.*?)\[/URL\]', re.IGNORECASE | re.DOTALL), r'<a href="\1" target="_blank">\1</a>'),
-        # Bold
-        (re.compile(r'\[B\](.*?)\[/B\]', re.IGNORECASE | re.DOTALL), r'<strong>\1</strong>'),
-        # Italic
-        (re.compile(r'\[I\](.*?)\[/I\]', re.IGNORECASE | re.DOTALL), r'<em>\1</em>'),
-        # Underline
-        (re.compile(r'\[U\](.*?)\[/U\]', re.IGNORECASE | re.DOTALL), r'<u>\1</u>'),
-        # Color (hex and named)
-        (re.compile(r'\[COLOR=(#?[\w]+)\](.*?)\[/COLOR\]', re.IGNORECASE | re.DOTALL), r'<span style="color: \1">\2</span>'),
-        # Images/Attachments - [IMG] tag with attachment.php URL
-        (re.compile(r'\[IMG\]http://nc\.biodiv\.tw/bbs/attachment\.php\?attachmentid=(\d+)(?:&d=\d+)?\[/IMG\]', re.IGNORECASE), rf'<img src="{storage_url}\1.jpg" alt="Attachment \1" style="max-width: 100%; height: auto; margin: 10px 0; border-radius: 4px;">'),
-        # Images/Attachments - [ATTACH] tag
-        (re.compile(r'\[attach\](\d+)\[/attach\]', re.IGNORECASE), rf'<img src="{storage_url}\1.jpg" alt="Attachment \1" style="max-width: 100%; height: auto; margin: 10px 0; border-radius: 4px;">'),
-        # Line breaks
-        (re.compile(r'\n'), r'<br>'),
-    ]
-
-    result = text
-
-    # Handle SIZE separately with the mapping function
-    result = re.sub(r'\[SIZE=(\d+)\](.*?)\[/SIZE\]', convert_size, result, flags=re.IGNORECASE | re.DOTALL)
-
-    for pattern, replacement in replacements:
-        result = pattern.sub(replacement, result)
-
-    return result
-
 def apply_extensions(app):
     # flask extensions
 
+    app.json = FastJSONProvider(app)
+
     # Register custom Jinja2 filters
     app.jinja_env.filters['bbcode'] = bbcode_to_html
+    app.jinja_env.globals['attachment_url'] = attachment_url
+
+    if app.config.get('SQL_PROFILE'):
+        from app.helpers.profiler import init_sql_profiler
+        init_sql_profiler(app)
+
+    if app.config.get('SLOW_QUERY_MS'):
+        from app.helpers.profiler import init_slow_query_log
+        from app.helpers.cache import my_redis
+        init_slow_query_log(app, my_redis)
+
+    if app.config.get('METRICS'):
+        from app.helpers.metrics import init_metrics
+        from app.helpers.cache import my_redis
+        init_metrics(app, my_redis)
 
     # Context processor for web analytics and storage
     @app.context_processor
@@ -185,17 +149,10 @@ def apply_extensions(app):
     #jwt = JWTManager(app)
     pass
 
-#session = init_db(flask_app.config)
-
 def create_app():
     #app = Flask(__name__, subdomain_matching=True, static_folder=None)
     app = Flask(__name__)
-    if os.getenv('WEB_ENV') == 'dev':
-        app.config.from_object('app.config.DevelopmentConfig')
-    elif os.getenv('WEB_ENV') == 'prod':
-        app.config.from_object('app.config.ProductionConfig')
-    else:
-        app.config.from_object('app.config.Config')
+    app.config.from_object(get_config_object())
 
     #app.config['BABEL_TRANSLATION_DIRECTORIES'] = 'translations' # default translations
     app.config['BABEL_DEFAULT_LOCALE'] = app.config['DEFAULT_LANG_CODE']
@@ -213,6 +170,7 @@ def create_app():
     app.url_map.strict_slashes = False
     #print(app.config, flush=True)
 
+    init_db(app.config)
     apply_blueprints(app)
     apply_extensions(app)
 
@@ -240,6 +198,13 @@ def debug_url_maps():
         rules.append([str(rule), str(rule.methods), rule.endpoint])
     return jsonify(rules)
 
+@flask_app.route('/pool_stats')
+def debug_pool_stats():
+    token = flask_app.config.get('POOL_STATS_TOKEN')
+    if not token or request.headers.get('Authorization') != f'Bearer {token}':
+        return abort(403)
+    return jsonify(get_pool_stats())
+
 @flask_app.teardown_appcontext
 def shutdown_session(exception=None):
     # SQLAlchemy won`t close connection, will occupy pool
@@ -0,0 +1,194 @@
+"""Async read-only variant of the catalog JSON APIs.
+
+Same routes and response shapes as app.blueprints.frontpage, running on an
+asyncio driver (asyncpg) with its own pool, so one process keeps many slow
+requests open without holding a worker each. Statements are the ones of
+app.helpers, only execution differs.
+
+    hypercorn asgi:app --bind 0.0.0.0:8002
+"""
+from quart import (
+    Quart,
+    request,
+    abort,
+    Response,
+)
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import (
+    create_async_engine,
+    async_sessionmaker,
+)
+
+from app.config import get_config_object
+from app.models import Library
+from app.helpers.library import read_config
+from app.helpers.collection import (
+    get_levels,
+    make_collection_tree_stmts,
+    make_collection_tree,
+)
+from app.helpers.item import (
+    parse_items_args,
+    make_item_rows_stmt,
+    make_count_stmt,
+    facet_keys,
+    make_facet_counts_stmt,
+    group_facet_counts,
+    make_items_data,
+    make_item_detail_stmts,
+    make_item_details,
+    make_items_cache_key,
+    is_plain_search,
+    parse_item_ids,
+    join_item_details,
+    MAX_BATCH_ITEMS,
+    CACHED_QUERIES,
+)
+from app.helpers.compress import make_payload, encode_payload
+from app.helpers.json_provider import dumps_bytes
+from app.helpers.cache import (
+    get_cache_async,
+    set_cache_async,
+    get_caches_async,
+    set_caches_async,
+    is_top_rank_async,
+)
+
+async_app = Quart(__name__)
+async_app.config.from_object(get_config_object())
+
+async_engine = None
+AsyncSession = async_sessionmaker(expire_on_commit=False)
+
+
+def make_async_engine(config):
+    uri = config.get('ASYNC_DATABASE_URI') or make_url(config['DATABASE_URI']).set(drivername='postgresql+asyncpg')
+    server_settings = {}
+    if x := config.get('DB_STATEMENT_TIMEOUT'):
+        server_settings['statement_timeout'] = str(int(x)) # ms
+    if x := config.get('DB_APPLICATION_NAME'):
+        server_settings['application_name'] = f'{x}-async'
+
+    return create_async_engine(
+        uri,
+        pool_size=config.get('ASYNC_DB_POOL_SIZE', 20),
+        max_overflow=config.get('ASYNC_DB_MAX_OVERFLOW', 10),
+        pool_timeout=config.get('DB_POOL_TIMEOUT', 30),
+        pool_recycle=config.get('DB_POOL_RECYCLE', -1),
+        pool_pre_ping=config.get('DB_POOL_PRE_PING', False),
+        connect_args={'server_settings': server_settings},
+    )
+
+
+@async_app.before_serving
+async def startup():
+    global async_engine
+    async_engine = make_async_engine(async_app.config)
+    AsyncSession.configure(bind=async_engine)
+
+
+@async_app.after_serving
+async def shutdown():
+    await async_engine.dispose()
+
+
+def make_json_payload(data, **extra):
+    return make_payload(dumps_bytes(data, async_app.config.get('JSON_PROVIDER', 'auto')), **extra)
+
+
+def payload_response(payload):
+    body, headers = encode_payload(payload, request.headers.get('Accept-Encoding'))
+    return Response(body, mimetype='application/json', headers=headers)
+
+
+async def execute_all(s, stmts):
+    return {key: (await s.execute(stmt)).all() for key, stmt in stmts.items()}
+
+
+async def get_library_config(s, library_id):
+    stmt = select(Library.name).where(Library.id == library_id)
+    if name := (await s.execute(stmt)).scalar():
+        return read_config(name)
+    return None
+
+
+@async_app.route('/api/library/<int:library_id>/collections')
+async def api_collections(library_id):
+    cache_key = f'lib-{library_id}-collections'
+    if x := await get_cache_async(cache_key):
+        return payload_response(x)
+
+    async with AsyncSession() as s:
+        if not (config := await get_library_config(s, library_id)):
+            return abort(404)
+        levels = get_levels(config)
+        results = await execute_all(s, make_collection_tree_stmts(library_id, levels, 2))
+    payload = make_json_payload(make_collection_tree(results, levels, 2))
+    await set_cache_async(cache_key, payload, 86400) # 1 day: 60 * 60 * 24
+
+    return payload_response(payload)
+
+
+@async_app.route('/api/library/<int:library_id>/items')
+async def api_items(library_id):
+    try:
+        filtr, limit, offset = parse_items_args(request.args)
+    except ValueError:
+        return abort(400)
+
+    top_query = False
+    if is_plain_search(filtr):
+        top_query = await is_top_rank_async(f'rank-lib-{library_id}-searches', filtr['q'], CACHED_QUERIES)
+    cache_key = make_items_cache_key(library_id, filtr, limit, offset, top_query)
+    if cache_key:
+        if x := await get_cache_async(cache_key):
+            return payload_response(x)
+
+    async with AsyncSession() as s:
+        stmt = make_item_rows_stmt(library_id, filtr)
+        total = (await s.execute(make_count_stmt(stmt))).scalar()
+        rows = (await s.execute(stmt.limit(limit).offset(offset))).all()
+        facets = None
+        if keys := facet_keys(await get_library_config(s, library_id)):
+            facets = group_facet_counts(await s.execute(make_facet_counts_stmt(library_id, filtr, keys)), keys)
+    payload = make_json_payload(make_items_data(rows, total, facets))
+
+    if cache_key:
+        await set_cache_async(cache_key, payload, 86400) # 1 day: 60 * 60 * 24
+
+    return payload_response(payload)
+
+
+@async_app.route('/api/items')
+async def api_item_details():
+    item_ids = parse_item_ids(request.args)
+    if len(item_ids) > MAX_BATCH_ITEMS:
+        return abort(400)
+
+    cached = await get_caches_async([f'item-{x}-detail' for x in item_ids])
+    payloads = {item_id: x for item_id, x in zip(item_ids, cached) if x}
+    if missing := [x for x in item_ids if x not in payloads]:
+        async with AsyncSession() as s:
+            results = await execute_all(s, make_item_detail_stmts(missing))
+        loaded = {x['id']: make_json_payload(x, library_id=x['library_id']) for x in make_item_details(missing, results)}
+        await set_caches_async({f'item-{item_id}-detail': x for item_id, x in loaded.items()}, 86400) # 1 day: 60 * 60 * 24
+        payloads.update(loaded)
+
+    return payload_response(make_payload(join_item_details(item_ids, payloads)))
+
+
+@async_app.route('/api/items/<int:item_id>')
+async def api_item_detail(item_id):
+    cache_key = f'item-{item_id}-detail'
+    if x := await get_cache_async(cache_key):
+        return payload_response(x)
+
+    async with AsyncSession() as s:
+        results = await execute_all(s, make_item_detail_stmts([item_id]))
+    if not (x := make_item_details([item_id], results)):
+        return abort(404)
+    payload = make_json_payload(x[0], library_id=x[0]['library_id'])
+    await set_cache_async(cache_key, payload, 86400) # 1 day: 60 * 60 * 24
+
+    return payload_response(payload)
@@ -10,12 +10,43 @@ from flask import (
     redirect,
     url_for,
     current_app,
+    Response,
+    stream_with_context,
+    send_file,
 )
-from app.database import session
+from app.database import session, use_replica
 from app.helpers.library import get_library
 from app.helpers.collection import get_collections
-from app.helpers.item import get_items
-from app.helpers.cache import get_cache, set_cache
+from app.helpers.item import (
+    parse_items_args,
+    get_items_data,
+    get_item_details,
+    make_items_cache_key,
+    is_plain_search,
+    parse_item_ids,
+    join_item_details,
+    MAX_BATCH_ITEMS,
+    CACHED_QUERIES,
+)
+from app.helpers.export import (
+    EXPORT_FORMATS,
+    iter_export,
+)
+from app.helpers.dwca import get_latest_dwca_path
+from app.helpers.suggest import suggest
+from app.helpers.compress import (
+    make_payload,
+    make_json_payload,
+    payload_response,
+)
+from app.helpers.cache import (
+    get_cache,
+    set_cache,
+    incr_rank,
+    is_top_rank,
+    get_caches,
+    set_caches,
+)
 from app.models import (
     Library,
     Item,
@@ -23,6 +54,11 @@ from app.models import (
 
 bp = Blueprint('frontpage', __name__)
 
+@bp.before_request
+def read_only_session():
+    # every frontpage view only reads
+    use_replica()
+
 @bp.route('/')
 def index():
 
@@ -33,66 +69,110 @@ def index():
 
 @bp.route('/items/<int:item_id>')
 def item_detail(item_id):
+    cache_key = f'item-{item_id}-page'
+    if not (payload := get_cache(cache_key)):
+        if not (page := render_item_detail(item_id)):
+            return abort(404)
+        payload = make_payload(page['html'], library_id=page['library_id'])
+        set_cache(cache_key, payload, 86400) # 1 day: 60 * 60 * 24
+
+    incr_rank(f'rank-lib-{payload["library_id"]}-items', item_id)
+    return payload_response(payload, 'text/html')
+
+
+def render_item_detail(item_id):
+    """Item page html, None: no such item. Needs a request context (warm up uses a test one)."""
     if item := session.get(Item, item_id):
         library = session.get(Library, item.library_id)
         item.proxy_field_data = OrderedDict()
         for fd in item.field_data:
             item.proxy_field_data[fd['name']] = fd
-        return render_template('item_detail.html', item=item, library=library)
-    else:
-        return abort(404)
+        return {
+            'library_id': item.library_id,
+            'html': render_template('item_detail.html', item=item, library=library),
+        }
 
 @bp.route('/api/library/<int:library_id>/collections')
 def api_collections(library_id):
     cache_key = f'lib-{library_id}-collections'
-    if x := get_cache(cache_key):
-        data = x
-    else:
-        data = get_collections(library_id, 2)
-        set_cache(cache_key, data, 86400) # 1 day: 60 * 60 * 24
+    if not (payload := get_cache(cache_key)):
+        payload = make_json_payload(get_collections(library_id, 2))
+        set_cache(cache_key, payload, 86400) # 1 day: 60 * 60 * 24
 
-    return jsonify(data)
+    return payload_response(payload)
 
 @bp.route('/api/library/<int:library_id>/items')
 def api_items(library_id):
-    q = request.args.get('q', '')
-    collection_id = request.args.get('collection_id', '')
-    limit = request.args.get('limit', 20)
-    offset = request.args.get('offset', 0)
-    filtr = {}
-    if q:
-        filtr['q'] = q
-    if collection_id:
-        filtr['collection_id'] = collection_id
-
-    if len(filtr) == 0:
-        cache_key = f'lib-{library_id}-items'
-        if x := get_cache(cache_key):
-            results = x
-        else:
-            results = get_items(library_id, filtr, limit, offset)
-            set_cache(cache_key, results, 86400) # 1 day: 60 * 60 * 24
+    try:
+        filtr, limit, offset = parse_items_args(request.args)
+    except ValueError:
+        return abort(400)
+
+    rank_key = f'rank-lib-{library_id}-searches'
+    top_query = is_plain_search(filtr) and is_top_rank(rank_key, filtr['q'], CACHED_QUERIES)
+    if cache_key := make_items_cache_key(library_id, filtr, limit, offset, top_query):
+        if not (payload := get_cache(cache_key)):
+            payload = make_json_payload(get_items_data(library_id, filtr, limit, offset))
+            set_cache(cache_key, payload, 86400) # 1 day: 60 * 60 * 24
     else:
-        results = get_items(library_id, filtr, limit, offset)
-
-    data = {
-        'items': [],
-        'total': results['total'],
-    }
-
-    for row in results['items']:
-        #TODO
-        name_zh_other = ''
-        status_id = '1'
-        if x := row.source_data.get('Chinese_name_other'):
-            name_zh_other = x
-        if x := row.source_data.get('status_id'):
-            status_id = 1
-        data['items'].append({
-            'id': row.id,
-            'name': row.name,
-            'name_zh': row.name_zh,
-            'name_zh_other': name_zh_other,
-            'status_id': status_id,
-        })
-    return jsonify(data)
+        payload = make_json_payload(get_items_data(library_id, filtr, limit, offset))
+
+    if is_plain_search(filtr) and offset == 0: # only searches warm-up can cache
+        incr_rank(rank_key, filtr['q'])
+
+    return payload_response(payload)
+
+@bp.route('/api/library/<int:library_id>/suggest')
+def api_suggest(library_id):
+    """Typeahead completions of ?q= (name, name_zh, other names), from the in-memory index."""
+    results = suggest(library_id, request.args.get('q', ''), request.args.get('limit', 10, type=int))
+    if results is None:
+        return abort(404)
+    return jsonify({'suggestions': results})
+
+@bp.route('/api/items')
+def api_item_details():
+    """Details of ?ids=1,2,3 (up to MAX_BATCH_ITEMS), per item cache + one set of queries for the misses."""
+    item_ids = parse_item_ids(request.args)
+    if len(item_ids) > MAX_BATCH_ITEMS:
+        return abort(400)
+
+    payloads = {item_id: x for item_id, x in zip(item_ids, get_caches([f'item-{x}-detail' for x in item_ids])) if x}
+    if missing := [x for x in item_ids if x not in payloads]:
+        loaded = {x['id']: make_json_payload(x, library_id=x['library_id']) for x in get_item_details(missing)}
+        set_caches({f'item-{item_id}-detail': x for item_id, x in loaded.items()}, 86400) # 1 day: 60 * 60 * 24
+        payloads.update(loaded)
+
+    return payload_response(make_payload(join_item_details(item_ids, payloads)))
+
+@bp.route('/api/items/<int:item_id>')
+def api_item_detail(item_id):
+    cache_key = f'item-{item_id}-detail'
+    if not (payload := get_cache(cache_key)):
+        if not (x := get_item_details([item_id])):
+            return abort(404)
+        payload = make_json_payload(x[0], library_id=x[0]['library_id'])
+        set_cache(cache_key, payload, 86400) # 1 day: 60 * 60 * 24
+
+    incr_rank(f'rank-lib-{payload["library_id"]}-items', item_id)
+    return payload_response(payload)
+
+@bp.route('/api/library/<int:library_id>/export')
+def api_export(library_id):
+    """All items of a library, streamed (ndjson: default, csv)."""
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in EXPORT_FORMATS or not session.get(Library, library_id):
+        return abort(404)
+
+    headers = {'Content-Disposition': f'attachment; filename=library-{library_id}.{fmt}'}
+    return Response(stream_with_context(iter_export(library_id, fmt)), mimetype=EXPORT_FORMATS[fmt], headers=headers)
+
+@bp.route('/api/library/<int:library_id>/dwca')
+def api_dwca(library_id):
+    """Darwin Core Archive, the newest one built (flask builddwca)."""
+    if not (library := session.get(Library, library_id)):
+        return abort(404)
+    if not (path := get_latest_dwca_path(library)):
+        return Response('not built yet, try again later', status=503, headers={'Retry-After': '600'})
+
+    return send_file(path, mimetype='application/zip', as_attachment=True, download_name=f'{library.name}-dwca.zip', conditional=True)
@@ -1,8 +1,22 @@
+import json
 import subprocess
 from app.application import flask_app
 import click
 
 from app.helpers.collection import import_collection
+from app.helpers.item import render_item_html, update_visibility
+from app.helpers.search import update_search_docs
+from app.helpers.warm import warm_cache
+from app.helpers.export import EXPORT_FORMATS, iter_export
+from app.helpers.dwca import build_dwca
+from app.helpers.snapshot import build_static
+from app.helpers.derivative import build_derivatives
+from app.helpers.tree import insert_collection, move_subtree, delete_subtree, move_items
+from app.helpers.metrics import registry
+from app.helpers.cache import my_redis
+from app.helpers.profiler import get_slow_queries, SlowQueryLog
+from app.helpers.explain import check_plans
+from app.models import Library
 
 
 @flask_app.cli.command('makemigrations')
@@ -22,4 +36,144 @@ def migrate():
 @click.argument('library_id')
 def importcollection(json_file, library_id):
     import_collection(json_file, library_id)
+    registry.flush(my_redis)
+    print_warm_results(warm_cache(flask_app, [library_id], clear=True))
+    print(f'dwca: {build_dwca(library_id)}')
 
+
+@flask_app.cli.command('renderhtml')
+@click.argument('library_id')
+@click.option('--all', 'render_all', is_flag=True, help='re-render rows already rendered')
+def renderhtml(library_id, render_all):
+    count = render_item_html(library_id, only_missing=not render_all)
+    print(f'rendered: {count}')
+
+@flask_app.cli.command('searchindex')
+@click.argument('library_id', required=False)
+def searchindex(library_id):
+    library_ids = [library_id] if library_id else [x.id for x in Library.query.all()]
+    for x in library_ids:
+        print(f'library {x} search documents: {update_search_docs(x)}')
+
+@flask_app.cli.command('visibility')
+@click.argument('library_id', type=int)
+@click.option('--reset', is_flag=True, help='list every item when the library has no rule')
+def visibility(library_id, reset):
+    print(f'items updated: {update_visibility(library_id, reset)}')
+
+@flask_app.cli.command('exportlibrary')
+@click.argument('library_id', type=int)
+@click.option('--format', 'fmt', type=click.Choice(list(EXPORT_FORMATS)), default='ndjson')
+@click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-', help='file, default stdout')
+def exportlibrary(library_id, fmt, output):
+    for chunk in iter_export(library_id, fmt):
+        output.write(chunk)
+
+@flask_app.cli.command('builddwca')
+@click.argument('library_id', type=int)
+def builddwca(library_id):
+    print(build_dwca(library_id) or 'locked, another build is running')
+
+@flask_app.cli.command('build-static')
+@click.argument('library_id', type=int)
+@click.option('--output', '-o', default='build', help='output directory')
+@click.option('--workers', default=4, help='rendering processes')
+@click.option('--full', is_flag=True, help='rebuild everything')
+def build_static_command(library_id, output, workers, full):
+    result = build_static(flask_app, library_id, output, workers=workers, full=full)
+    print(f'item pages: {result["pages"]}, deleted: {result["deleted"]}, json pages: {result["json_pages"]}')
+
+@flask_app.cli.command('derivatives')
+@click.argument('library_id', type=int)
+@click.option('--workers', default=4, help='image processes')
+@click.option('--force', is_flag=True, help='regenerate all')
+def derivatives(library_id, workers, force):
+    result = build_derivatives(library_id, workers=workers, force=force)
+    for x in result['errors']:
+        print(x)
+    print(f'done: {result["done"]}, failed: {result["failed"]}')
+
+@flask_app.cli.group('tree')
+def tree():
+    """Edit the collection tree (closure, paths, caches kept in sync)."""
+
+@tree.command('add')
+@click.argument('parent_id', type=int)
+@click.argument('name')
+@click.option('--level', required=True)
+@click.option('--name-zh')
+def tree_add(parent_id, name, level, name_zh):
+    collection = insert_collection(parent_id, name, level, name_zh=name_zh)
+    print(f'added: {collection.id} {collection.path}')
+
+@tree.command('move')
+@click.argument('collection_id', type=int)
+@click.argument('new_parent_id', type=int)
+def tree_move(collection_id, new_parent_id):
+    collection = move_subtree(collection_id, new_parent_id)
+    print(f'moved: {collection.id} {collection.path}')
+
+@tree.command('delete')
+@click.argument('collection_id', type=int)
+def tree_delete(collection_id):
+    count, item_ids = delete_subtree(collection_id)
+    print(f'deleted collections: {count}, unlinked items: {len(item_ids)}')
+
+@tree.command('moveitems')
+@click.argument('collection_id', type=int)
+@click.argument('item_ids', type=int, nargs=-1, required=True)
+def tree_move_items(collection_id, item_ids):
+    print(f'moved items: {move_items(list(item_ids), collection_id)}')
+
+@flask_app.cli.command('warmcache')
+@click.option('--library', 'library_ids', multiple=True, type=int, help='library id, default all')
+@click.option('--pages', default=5, help='first item pages')
+@click.option('--searches', default=20, help='top searches')
+@click.option('--items', default=100, help='top item details')
+@click.option('--workers', default=4, help='parallel tasks')
+@click.option('--clear', is_flag=True, help='delete library caches first')
+def warmcache(library_ids, pages, searches, items, workers, clear):
+    results = warm_cache(
+        flask_app,
+        library_ids,
+        num_pages=pages,
+        num_searches=searches,
+        num_items=items,
+        workers=workers,
+        clear=clear,
+    )
+    print_warm_results(results)
+
+
+def print_warm_results(results):
+    for library_id, task, count in results:
+        print(f'library {library_id} {task}: {count}')
+
+@flask_app.cli.command('slowqueries')
+@click.option('--limit', default=20)
+@click.option('--clear', is_flag=True, help='empty the slow query log')
+def slowqueries(limit, clear):
+    if clear:
+        my_redis.delete(SlowQueryLog.REDIS_KEY)
+        return
+    for x in get_slow_queries(my_redis, limit):
+        print(f'--- {x["time"]} {x["duration_ms"]}ms {x["path"] or ""}')
+        print(x['statement'])
+        print(f'parameters: {x["parameters"]}')
+        print(x['plan'] or '')
+
+@flask_app.cli.command('explaincheck')
+@click.argument('library_id', type=int)
+@click.option('--min-rows', default=10000, help='tables smaller than this may be seq scanned')
+@click.option('--verbose', '-v', is_flag=True, help='print the plans')
+@click.option('--no-analyze', is_flag=True, help='keep the current table statistics')
+def explaincheck(library_id, min_rows, verbose, no_analyze):
+    """EXPLAIN the hot queries of a library, exit 1 on a seq scan of a large table."""
+    failed = 0
+    for name, plan, problems in check_plans(library_id, min_rows, analyze=not no_analyze):
+        print(f'{"FAIL" if problems else "ok  "} {name:<28} cost={plan["Plan"]["Total Cost"]} {"; ".join(problems)}')
+        if verbose:
+            print(json.dumps(plan, indent=2))
+        failed += bool(problems)
+    if failed:
+        raise SystemExit(1)
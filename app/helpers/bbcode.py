@@ -0,0 +1,166 @@
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+
+## nc: specific
+DEFAULT_STORAGE_URL = 'https://f001.backblazeb2.com/file/nc-media/'
+
+# every tag we know + line breaks, one scan over the text
+TOKEN_RE = re.compile(r'\[(/?)(size|url|b|i|u|color|img|attach)(?:=([^\]]*))?\]|\n', re.IGNORECASE)
+SIZE_ARG_RE = re.compile(r'\d+')
+COLOR_ARG_RE = re.compile(r'#?\w+')
+ATTACH_ID_RE = re.compile(r'\d+')
+IMG_SRC_RE = re.compile(r'http://nc\.biodiv\.tw/bbs/attachment\.php\?attachmentid=(\d+)(?:&d=\d+)?', re.IGNORECASE)
+
+# BBCode size to actual CSS size
+SIZE_MAP = {
+    1: '0.8em',
+    2: '0.9em',
+    3: '1em',
+    4: '1.2em',
+    5: '1.5em',
+    6: '1.8em',
+    7: '2em',
+}
+
+SIMPLE_TAGS = {
+    'b': 'strong',
+    'i': 'em',
+    'u': 'u',
+}
+
+MEMO_SIZE = 2048
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def _attachment_img(attachment_id, storage_url):
+    return f'<img src="{storage_url}{attachment_id}.jpg" alt="Attachment {attachment_id}" style="max-width: 100%; height: auto; margin: 10px 0; border-radius: 4px;">'
+
+
+def _valid_open(tag, arg):
+    if tag == 'size':
+        return arg is not None and SIZE_ARG_RE.fullmatch(arg)
+    if tag == 'color':
+        return arg is not None and COLOR_ARG_RE.fullmatch(arg)
+    if tag == 'url':
+        return True
+    return arg is None
+
+
+def _close(frame, raw, storage_url):
+    """Render a matched [tag]...[/tag] pair, or None to keep it as literal text."""
+    tag, arg, parts, _, _ = frame
+    content = ''.join(parts)
+
+    if tag in SIMPLE_TAGS:
+        return f'<{SIMPLE_TAGS[tag]}>{content}</{SIMPLE_TAGS[tag]}>'
+    if tag == 'size':
+        size = int(arg)
+        css_size = SIZE_MAP.get(size, f'{size * 0.2}em')
+        return f'<span style="font-size: {css_size}">{content}</span>'
+    if tag == 'color':
+        return f'<span style="color: {arg}">{content}</span>'
+    if tag == 'url':
+        if arg is None:
+            return f'<a href="{raw}" target="_blank">{content}</a>'
+        href = arg[1:] if arg.startswith('"') else arg
+        href = href[:-1] if href.endswith('"') else href
+        return f'<a href="{href}" target="_blank">{content}</a>'
+    if tag == 'img':
+        if m := IMG_SRC_RE.fullmatch(raw):
+            return _attachment_img(m.group(1), storage_url)
+    if tag == 'attach':
+        if ATTACH_ID_RE.fullmatch(raw):
+            return _attachment_img(raw, storage_url)
+    return None
+
+
+def render_bbcode(text, storage_url=DEFAULT_STORAGE_URL):
+    """Convert BBCode to HTML in a single pass (no memo).
+
+    Tags are matched with a stack, unmatched or invalid tags are kept as
+    literal text, same as the old regex passes did for well-formed markup.
+    """
+    # frame: [tag, arg, parts, content_start, open_token]
+    root = [None, None, [], 0, '']
+    stack = [root]
+    pos = 0
+
+    def unwind(frame):
+        # unclosed tag: give back the literal open token and its content
+        stack[-1][2].append(frame[4])
+        stack[-1][2].extend(frame[2])
+
+    for m in TOKEN_RE.finditer(text):
+        if m.start() > pos:
+            stack[-1][2].append(text[pos:m.start()])
+        pos = m.end()
+
+        token = m.group(0)
+        if token == '\n':
+            stack[-1][2].append('<br>')
+            continue
+
+        is_close, tag, arg = m.group(1), m.group(2).lower(), m.group(3)
+        if not is_close:
+            if _valid_open(tag, arg):
+                stack.append([tag, arg, [], m.end(), token])
+            else:
+                stack[-1][2].append(token)
+            continue
+
+        idx = None
+        if arg is None:
+            for i in range(len(stack) - 1, 0, -1):
+                if stack[i][0] == tag:
+                    idx = i
+                    break
+        if idx is None:
+            stack[-1][2].append(token)
+            continue
+
+        while len(stack) - 1 > idx:
+            unwind(stack.pop())
+        frame = stack.pop()
+        html = _close(frame, text[frame[3]:m.start()], storage_url)
+        if html is None:
+            stack[-1][2].append(frame[4])
+            stack[-1][2].extend(frame[2])
+            stack[-1][2].append(token)
+        else:
+            stack[-1][2].append(html)
+
+    if pos < len(text):
+        stack[-1][2].append(text[pos:])
+    while len(stack) > 1:
+        unwind(stack.pop())
+
+    return ''.join(root[2])
+
+
+def bbcode_to_html(text, storage_url=DEFAULT_STORAGE_URL):
+    """Convert BBCode to HTML for display.
+
+    Args:
+        text: BBCode text to convert
+        storage_url: Base URL for media storage (from library config)
+    """
+    if not text:
+        return ''
+
+    key = (hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest(), storage_url)
+    with _memo_lock:
+        if key in _memo:
+            _memo.move_to_end(key)
+            return _memo[key]
+
+    html = render_bbcode(text, storage_url)
+
+    with _memo_lock:
+        _memo[key] = html
+        if len(_memo) > MEMO_SIZE:
+            _memo.popitem(last=False)
+
+    return html
@@ -1,16 +1,112 @@
 import pickle
 
 import redis
+import redis.asyncio
+
+from app.helpers.metrics import registry, cache_namespace
 
 my_redis = redis.Redis(host='redis', port=6379, db=0) # TODO move to config
+# for app.async_api, same keys and pickles
+my_async_redis = redis.asyncio.Redis(host='redis', port=6379, db=0)
+
+# format of the cached values (compress payloads), part of every key: bump it
+# when the format changes so entries pickled by older code are never read
+CACHE_VERSION = 'v2'
+
+
+def versioned(key):
+    return f'{CACHE_VERSION}:{key}'
 
 
 def get_cache(key):
-    if x := my_redis.get(key):
+    if x := my_redis.get(versioned(key)):
+        registry.inc('cache_requests_total', {'namespace': cache_namespace(key), 'result': 'hit'})
         return pickle.loads(x)
+    registry.inc('cache_requests_total', {'namespace': cache_namespace(key), 'result': 'miss'})
     return None
 
 def set_cache(key, value, expire=0):
-    my_redis.set(key, pickle.dumps(value))
-    if expire:
-        my_redis.expire(key, expire)
+    my_redis.set(versioned(key), pickle.dumps(value), ex=expire or None)
+
+def get_caches(keys):
+    """Several keys in one round trip, None for misses."""
+    values = []
+    for key, x in zip(keys, my_redis.mget([versioned(k) for k in keys]) if keys else []):
+        registry.inc('cache_requests_total', {'namespace': cache_namespace(key), 'result': 'hit' if x else 'miss'})
+        values.append(pickle.loads(x) if x else None)
+    return values
+
+def set_caches(mapping, expire=0):
+    pipe = my_redis.pipeline(transaction=False)
+    for key, value in mapping.items():
+        pipe.set(versioned(key), pickle.dumps(value), ex=expire or None)
+    pipe.execute()
+
+async def get_cache_async(key):
+    if x := await my_async_redis.get(versioned(key)):
+        registry.inc('cache_requests_total', {'namespace': cache_namespace(key), 'result': 'hit'})
+        return pickle.loads(x)
+    registry.inc('cache_requests_total', {'namespace': cache_namespace(key), 'result': 'miss'})
+    return None
+
+async def set_cache_async(key, value, expire=0):
+    await my_async_redis.set(versioned(key), pickle.dumps(value), ex=expire or None)
+
+async def get_caches_async(keys):
+    values = []
+    for key, x in zip(keys, await my_async_redis.mget([versioned(k) for k in keys]) if keys else []):
+        registry.inc('cache_requests_total', {'namespace': cache_namespace(key), 'result': 'hit' if x else 'miss'})
+        values.append(pickle.loads(x) if x else None)
+    return values
+
+async def set_caches_async(mapping, expire=0):
+    pipe = my_async_redis.pipeline(transaction=False)
+    for key, value in mapping.items():
+        pipe.set(versioned(key), pickle.dumps(value), ex=expire or None)
+    await pipe.execute()
+
+def delete_cache(pattern):
+    count = 0
+    for key in my_redis.scan_iter(match=versioned(pattern), count=500):
+        my_redis.delete(key)
+        count += 1
+    return count
+
+def delete_keys(keys):
+    if keys:
+        my_redis.delete(*[versioned(x) for x in keys])
+
+def delete_item_caches(item_ids, chunk_size=1000):
+    """Cached detail JSON and page of the items."""
+    item_ids = list(item_ids)
+    for i in range(0, len(item_ids), chunk_size):
+        delete_keys([f'item-{x}-{kind}' for x in item_ids[i:i + chunk_size] for kind in ('detail', 'page')])
+
+def lock_cache(key, expire):
+    """True for the first caller until expire, e.g. one warm-up per deploy."""
+    return bool(my_redis.set(versioned(key), 1, nx=True, ex=expire))
+
+# popularity counters (sorted sets), used to pick what to warm up
+
+RANK_SIZE = 1000 # members kept per counter, warm-up reads the top 100 at most
+
+def incr_rank(key, member):
+    pipe = my_redis.pipeline(transaction=False)
+    pipe.zincrby(key, 1, member)
+    pipe.zcard(key)
+    _, size = pipe.execute()
+    # trim only once it doubled, new members get time to rise above the lowest
+    if size > 2 * RANK_SIZE:
+        my_redis.zremrangebyrank(key, 0, -RANK_SIZE - 1) # drop all but the top RANK_SIZE
+
+def is_top_rank(key, member, num):
+    """member is one of the num highest of the counter."""
+    rank = my_redis.zrevrank(key, member)
+    return rank is not None and rank < num
+
+async def is_top_rank_async(key, member, num):
+    rank = await my_async_redis.zrevrank(key, member)
+    return rank is not None and rank < num
+
+def get_top_ranks(key, num):
+    return [x.decode('utf-8') for x in my_redis.zrevrange(key, 0, num - 1)]
@@ -1,9 +1,18 @@
 import json
+import time
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy import (
     select,
+    update,
     func,
+    and_,
+    cast,
+    literal,
+    literal_column,
+    String,
 )
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.orm import aliased
 
 from app.models import (
     Collection,
@@ -13,9 +22,14 @@ from app.models import (
     CollectionItem
 )
 from app.database import session
-from app.helpers.library import get_config
+from app.helpers.library import get_config, bump_data_version
+from app.helpers.item import render_item_html, get_visibility_rule, update_visibility
+from app.helpers.search import update_search_docs
+from app.helpers.metrics import registry
 
 def import_collection(json_file, library_id):
+    start = time.perf_counter()
+    get_visibility_rule(library_id) # fail before writing anything
     with open(json_file) as f:
         data = json.load(f)
 
@@ -147,86 +161,181 @@ def import_collection(json_file, library_id):
                             print(f'{paths[depth]} or {paths[depth2]} not found')
             #print(count)
 
+        session.execute(make_collection_paths_stmt(library_id))
+        session.commit()
+
+        update_visibility(library_id)
+        render_item_html(library_id)
+        update_search_docs(library_id)
+        bump_data_version(library_id)
+
+        registry.inc('import_items_total', {'library': library_id}, len(species_list))
+        registry.inc('import_duration_seconds', {'library': library_id}, time.perf_counter() - start)
+
         return species_list
 
 
-def get_collections(library_id, to_depth):
-    data = []
-    conf = get_config(library_id)
-    levels = conf['collection'].get('levels').split(',')
-    last_collection_level = len(levels)-2
+def make_collection_paths_stmt(library_id):
+    """Set Collection.path of a library from the closure table, one UPDATE."""
+    paths = (
+        select(
+            CollectionClosure.descendant_id,
+            (
+                literal('/')
+                + func.string_agg(
+                    cast(CollectionClosure.ancestor_id, String),
+                    aggregate_order_by(literal_column("'/'"), CollectionClosure.depth.desc()),
+                )
+                + literal('/')
+            ).label('path'),
+        )
+        .join(
+            Collection,
+            Collection.id == CollectionClosure.descendant_id,
+        )
+        .where(Collection.library_id == library_id)
+        .group_by(CollectionClosure.descendant_id)
+        .subquery()
+    )
+    return (
+        update(Collection)
+        .where(Collection.id == paths.c.descendant_id)
+        .values(path=paths.c.path)
+    )
 
-    def get_closures(ancestor_id, current_level):
-        current_level += 1
-        if current_level <= to_depth:
-            children = []
-            descendants = CollectionClosure.query.filter(CollectionClosure.ancestor_id==ancestor_id, CollectionClosure.depth==1).all()
-            for d in descendants:
-                child = {
-                    'name': d.descendant.name,
-                    'name_zh': d.descendant.name_zh,
-                    'id': d.descendant.id,
-                    'children': get_closures(d.descendant_id, current_level),
-                    'level': levels[current_level],
-                    'count': count_collection_items(d.descendant_id),
-                }
-                children.append(child)
 
-            return children
+def get_levels(config):
+    return config['collection'].get('levels').split(',')
 
-    collections = Collection.query.filter(Collection.level==levels[0], Collection.library_id==library_id).order_by(Collection.name).all()
-    for i in collections:
-        children = get_closures(i.id, 0)
-        data.append({
-            'name': i.name,
-            'name_zh': i.name_zh,
-            'id': i.id,
-            'children': children,
-            'level': levels[0],
-            'count': count_collection_items(i.id),
-        })
 
-    return data
+def make_collection_counts_stmt(library_id, ancestor_ids):
+    """Item count under each ancestor (closure includes itself), grouped by ancestor_id."""
+    return (
+        select(
+            CollectionClosure.ancestor_id,
+            func.count(Item.id)
+        )
+        .select_from(CollectionClosure)
+        .join(
+            CollectionItem,
+            CollectionItem.collection_id == CollectionClosure.descendant_id,
+            isouter=True
+        )
+        .join(
+            Item,
+            and_(
+                Item.id == CollectionItem.item_id,
+                Item.is_visible,
+            ),
+            isouter=True
+        )
+        .where(
+            CollectionClosure.ancestor_id.in_(ancestor_ids)
+        )
+        .group_by(
+            CollectionClosure.ancestor_id
+        )
+    )
 
 
-def count_collection_items(ancestor_id):
-    collection = session.get(Collection, ancestor_id)
-    if collection.library_id == 1: # species rules, filter field_id=1 and value = 1
-        stmt = (
+def make_collection_tree_stmts(library_id, levels, to_depth):
+    """Roots, parent-child edges and counts down to to_depth, three queries for the whole tree."""
+    root_ids = (
+        select(
+            Collection.id
+        )
+        .where(
+            Collection.level == levels[0],
+            Collection.library_id == library_id,
+        )
+    )
+    path = aliased(CollectionClosure) # root -> parent
+    return {
+        'roots': (
+            select(
+                Collection.id,
+                Collection.name,
+                Collection.name_zh,
+            )
+            .where(
+                Collection.id.in_(root_ids)
+            )
+            .order_by(Collection.name)
+        ),
+        'edges': (
             select(
-                func.count(CollectionItem.id)
+                CollectionClosure.ancestor_id,
+                Collection.id,
+                Collection.name,
+                Collection.name_zh,
             )
-            .select_from(CollectionClosure)
             .join(
-                CollectionItem,
-                CollectionItem.collection_id == CollectionClosure.descendant_id,
-                isouter=True
+                Collection,
+                Collection.id == CollectionClosure.descendant_id,
             )
             .join(
-                ItemData,
-                ItemData.item_id == CollectionItem.item_id,
-                isouter=True
+                path,
+                path.descendant_id == CollectionClosure.ancestor_id,
             )
             .where(
-                CollectionClosure.ancestor_id == ancestor_id,
-                ItemData.value == '1'
+                CollectionClosure.depth == 1,
+                path.ancestor_id.in_(root_ids),
+                path.depth < to_depth,
             )
-        )
-    else:
-        stmt = (
+            .order_by(Collection.name)
+        ),
+        'counts': make_collection_counts_stmt(
+            library_id,
             select(
-                func.count(CollectionItem.id)
-            )
-            .select_from(CollectionClosure)
-            .join(
-                CollectionItem,
-                CollectionItem.collection_id == CollectionClosure.descendant_id,
-                isouter=True
+                CollectionClosure.descendant_id
             )
             .where(
-                CollectionClosure.ancestor_id == ancestor_id
+                CollectionClosure.ancestor_id.in_(root_ids),
+                CollectionClosure.depth <= to_depth,
             )
-        )
+        ),
+    }
+
 
-    count = session.execute(stmt).scalar()
-    return count
+def make_collection_tree(results, levels, to_depth):
+    children = {}
+    for x in results['edges']:
+        children.setdefault(x.ancestor_id, []).append(x)
+    counts = {ancestor_id: count for ancestor_id, count in results['counts']}
+
+    def get_children(ancestor_id, current_level):
+        # None below to_depth
+        current_level += 1
+        if current_level <= to_depth:
+            return [{
+                'name': d.name,
+                'name_zh': d.name_zh,
+                'id': d.id,
+                'children': get_children(d.id, current_level),
+                'level': levels[current_level],
+                'count': counts.get(d.id, 0),
+            } for d in children.get(ancestor_id, [])]
+
+    return [{
+        'name': i.name,
+        'name_zh': i.name_zh,
+        'id': i.id,
+        'children': get_children(i.id, 0),
+        'level': levels[0],
+        'count': counts.get(i.id, 0),
+    } for i in results['roots']]
+
+
+def get_collections(library_id, to_depth):
+    levels = get_levels(get_config(library_id))
+    stmts = make_collection_tree_stmts(library_id, levels, to_depth)
+    results = {key: session.execute(stmt).all() for key, stmt in stmts.items()}
+    return make_collection_tree(results, levels, to_depth)
+
+
+def count_collection_items(ancestor_id):
+    collection = session.get(Collection, ancestor_id)
+    stmt = make_collection_counts_stmt(collection.library_id, [ancestor_id])
+    if row := session.execute(stmt).first():
+        return row[1]
+    return 0
@@ -0,0 +1,64 @@
+"""Response payloads: serialized once, gzipped once, stored in the cache as is.
+
+A payload is {'identity': bytes, 'gzip': bytes or None, ...extra}, extra keys
+(e.g. library_id for ranking) ride along. Cache hits send one of the two
+bodies without serializing or compressing again.
+"""
+import gzip
+
+from flask import (
+    current_app,
+    request,
+    Response,
+)
+
+GZIP_MIN_SIZE = 1024 # bytes, smaller bodies aren't worth it
+GZIP_LEVEL = 6
+
+
+def make_payload(body, **extra):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    payload = {'identity': body, 'gzip': None, **extra}
+    if len(body) >= GZIP_MIN_SIZE:
+        payload['gzip'] = gzip.compress(body, GZIP_LEVEL, mtime=0)
+    return payload
+
+
+def make_json_payload(data, **extra):
+    """Needs an app context (FastJSONProvider of the app)."""
+    return make_payload(current_app.json.dumps_bytes(data), **extra)
+
+
+def parse_qvalue(params):
+    q = params.strip()
+    if q.startswith('q='):
+        try:
+            return float(q[2:])
+        except ValueError:
+            return 0
+    return 1
+
+
+def accepts_gzip(accept_encoding):
+    # Accept-Encoding: gzip, deflate, br / gzip;q=0 / * / *;q=0, gzip
+    qvalues = {}
+    for part in (accept_encoding or '').split(','):
+        coding, _, params = part.strip().partition(';')
+        qvalues.setdefault(coding.strip().lower(), parse_qvalue(params))
+    # an explicit gzip entry wins over *
+    return qvalues.get('gzip', qvalues.get('*', 0)) > 0
+
+
+def encode_payload(payload, accept_encoding):
+    """(body, headers) for the client's Accept-Encoding."""
+    headers = {'Vary': 'Accept-Encoding'}
+    if payload['gzip'] and accepts_gzip(accept_encoding):
+        headers['Content-Encoding'] = 'gzip'
+        return payload['gzip'], headers
+    return payload['identity'], headers
+
+
+def payload_response(payload, mimetype='application/json'):
+    body, headers = encode_payload(payload, request.headers.get('Accept-Encoding'))
+    return Response(body, mimetype=mimetype, headers=headers)
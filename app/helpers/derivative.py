@@ -0,0 +1,174 @@
+"""Attachment derivatives: fixed-size thumbnails and web-size images.
+
+Originals are read from the mounted bucket (BUCKET_FOLDER/{storage prefix}{path}),
+derivatives are written next to them as _derivatives/{size}/{path}.jpg (the
+original name kept, a/b.png and a/b.tif do not share a file) and served
+by the same storage url. They are recorded on ItemAttachment.derivatives:
+
+    {'thumb': {'path': '_derivatives/thumb/a/b.png.jpg', 'width': 320, 'height': 320}, ...}
+
+Attachments that already have every size are skipped, so re-running only
+processes new uploads. Images are decoded and resized in a process pool,
+rows are updated by this process.
+"""
+import os
+from pathlib import Path, PurePosixPath
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from sqlalchemy import (
+    select,
+    update,
+    bindparam,
+    or_,
+)
+from sqlalchemy.dialects.postgresql import array
+
+from app.models import (
+    Item,
+    ItemAttachment,
+)
+from app.database import session, dispose_engines
+from app.helpers.library import get_storage_config
+from app.helpers.cache import delete_item_caches
+from app.helpers.item import bump_item_versions
+
+# name: (pixels, crop), crop: square thumbnail, else the longest edge
+SIZES = {
+    'thumb': (320, True),
+    'web': (1280, False),
+}
+DERIVATIVE_FOLDER = '_derivatives'
+JPEG_QUALITY = 82
+CHUNK_SIZE = 200 # rows updated per commit
+
+
+def derivative_path(path, size):
+    return str(PurePosixPath(DERIVATIVE_FOLDER, size, f"{path.lstrip('/')}.jpg"))
+
+
+def save_image(image, dest):
+    # atomic, a half written file is never served
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = dest.with_name(f'.{dest.name}.tmp')
+    image.save(tmp_path, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    os.replace(tmp_path, dest)
+
+
+def is_fresh(src, dest):
+    return dest.exists() and dest.stat().st_mtime >= src.stat().st_mtime
+
+
+def make_derivatives(root, attachment_id, path):
+    """Process pool task: (attachment_id, {size: derivative}, error)."""
+    # only the image processes need Pillow, not the web workers importing this module
+    from PIL import Image, ImageOps
+
+    src = Path(root, path.lstrip('/'))
+    dests = {size: Path(root, derivative_path(path, size)) for size in SIZES}
+    result = {}
+    try:
+        if all(is_fresh(src, x) for x in dests.values()):
+            # files are there (e.g. db restored), only read their sizes
+            for size, dest in dests.items():
+                with Image.open(dest) as image:
+                    result[size] = {'path': derivative_path(path, size), 'width': image.width, 'height': image.height}
+            return attachment_id, result, None
+
+        with Image.open(src) as image:
+            # JPEG: decode at a reduced scale, still >= the largest size
+            largest = max(x for x, _ in SIZES.values())
+            image.draft('RGB', (largest, largest))
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            for size, (pixels, crop) in SIZES.items():
+                if crop:
+                    resized = ImageOps.fit(image, (pixels, pixels), Image.Resampling.LANCZOS)
+                else:
+                    resized = image.copy()
+                    resized.thumbnail((pixels, pixels), Image.Resampling.LANCZOS)
+                save_image(resized, dests[size])
+                result[size] = {'path': derivative_path(path, size), 'width': resized.width, 'height': resized.height}
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        return attachment_id, None, f'{path}: {e}'
+    return attachment_id, result, None
+
+
+def make_pending_stmt(library_id, force=False):
+    """Image attachments of a library without every derivative size."""
+    stmt = (
+        select(
+            ItemAttachment.id,
+            ItemAttachment.item_id,
+            ItemAttachment.path,
+        )
+        .join(
+            Item,
+            Item.id == ItemAttachment.item_id,
+        )
+        .where(
+            Item.library_id == library_id,
+            ItemAttachment.mimetype.like('image/%'),
+        )
+        .order_by(ItemAttachment.id)
+    )
+    if not force:
+        stmt = stmt.where(
+            or_(
+                ItemAttachment.derivatives.is_(None),
+                ~ItemAttachment.derivatives.has_all(array(list(SIZES))),
+            )
+        )
+    return stmt
+
+
+def build_derivatives(library_id, workers=4, force=False):
+    """Generate missing derivatives of a library.
+
+    Returns: {'done', 'failed', 'errors'}
+    """
+    storage = get_storage_config(library_id)
+    root = Path(current_app.config['BUCKET_FOLDER'], storage['prefix'] if storage else '')
+    rows = session.execute(make_pending_stmt(library_id, force)).all()
+    item_ids = {x.id: x.item_id for x in rows}
+    session.rollback() # no transaction open while images are processed
+
+    stmt_u = (
+        update(ItemAttachment)
+        .where(ItemAttachment.id == bindparam('attachment_id'))
+        .values(derivatives=bindparam('derivatives'))
+    )
+    result = {'done': 0, 'failed': 0, 'errors': []}
+    values = []
+    changed = set()
+
+    def flush():
+        session.connection().execute(stmt_u, values)
+        # pages embed the derivative urls, build_static re-renders by version
+        bump_item_versions({item_ids[x['attachment_id']] for x in values})
+        session.commit()
+        values.clear()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=dispose_engines) as executor:
+        tasks = executor.map(
+            make_derivatives,
+            [root] * len(rows),
+            [x.id for x in rows],
+            [x.path for x in rows],
+            chunksize=16,
+        )
+        for attachment_id, derivatives, error in tasks:
+            if error:
+                result['failed'] += 1
+                result['errors'].append(error)
+                continue
+            values.append({'attachment_id': attachment_id, 'derivatives': derivatives})
+            changed.add(item_ids[attachment_id])
+            result['done'] += 1
+            if len(values) >= CHUNK_SIZE:
+                flush()
+    if values:
+        flush()
+
+    # cached details and pages carry the attachment urls
+    delete_item_caches(changed)
+    return result
@@ -0,0 +1,242 @@
+"""Darwin Core Archive of a library: taxon core, one row per collection and item.
+
+The zip is written to EXPORT_FOLDER as {library}-dwca-{data_version}.zip, so
+it is built once per data version (import bumps it) and downloads are plain
+static files (send_file: conditional, range requests). It is built by the
+CLI (builddwca, importcollection) only; requests serve the newest archive.
+"""
+import io
+import os
+import json
+import zipfile
+import tempfile
+from pathlib import Path
+
+from flask import current_app
+from sqlalchemy import select
+
+from app.models import (
+    Library,
+    Item,
+    ItemData,
+    Field,
+    Collection,
+    CollectionItem,
+    CollectionClosure,
+)
+from app.database import session
+from app.helpers.library import read_config
+from app.helpers.cache import lock_cache, delete_cache
+
+DWC_NS = 'http://rs.tdwg.org/dwc/terms/'
+HIGHER_RANKS = ('kingdom', 'phylum', 'class', 'order', 'family', 'genus')
+CORE_TERMS = (
+    'taxonID',
+    'parentNameUsageID',
+    'scientificName',
+    'vernacularName',
+    'taxonRank',
+) + HIGHER_RANKS
+CHUNK_SIZE = 1000
+
+META_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<archive xmlns="http://rs.tdwg.org/dwc/text/">
+  <core encoding="UTF-8" fieldsTerminatedBy="\\t" linesTerminatedBy="\\n" fieldsEnclosedBy="" ignoreHeaderLines="1" rowType="http://rs.tdwg.org/dwc/terms/Taxon">
+    <files>
+      <location>taxon.txt</location>
+    </files>
+    <id index="0"/>
+{fields}
+  </core>
+</archive>
+'''
+
+
+def dwc_terms(config):
+    """Extra terms from the library ini: [dwc] term = ItemData field or source_data key."""
+    if config and config.has_section('dwc'):
+        return dict(config.items('dwc'))
+    return {}
+
+
+def clean(value):
+    # no quoting in the text file: tabs and newlines become spaces
+    if value is None:
+        return ''
+    return ' '.join(str(value).split())
+
+
+def get_collection_rows(library_id):
+    """{collection_id: row} with the higher rank names, from 2 queries."""
+    collections = {x.id: x for x in session.execute(
+        select(
+            Collection.id,
+            Collection.key,
+            Collection.name,
+            Collection.level,
+            Collection.name_zh,
+        )
+        .where(Collection.library_id == library_id)
+    )}
+    parents = dict(session.execute(
+        select(
+            CollectionClosure.descendant_id,
+            CollectionClosure.ancestor_id,
+        )
+        .where(
+            CollectionClosure.depth == 1,
+            CollectionClosure.descendant_id.in_(list(collections)),
+        )
+    ).all())
+
+    rows = {}
+
+    def make_row(collection_id):
+        if collection_id in rows:
+            return rows[collection_id]
+        x = collections[collection_id]
+        parent_id = parents.get(collection_id)
+        parent = make_row(parent_id) if parent_id in collections else None
+        row = {rank: parent[rank] for rank in HIGHER_RANKS} if parent else {rank: '' for rank in HIGHER_RANKS}
+        if x.level in HIGHER_RANKS:
+            row[x.level] = x.name
+        row.update({
+            'taxonID': x.key,
+            'parentNameUsageID': parent['taxonID'] if parent else '',
+            'scientificName': x.name,
+            'vernacularName': x.name_zh,
+            'taxonRank': x.level,
+        })
+        rows[collection_id] = row
+        return row
+
+    for collection_id in collections:
+        make_row(collection_id)
+    return rows
+
+
+def iter_taxon_rows(library_id, terms, chunk_size=CHUNK_SIZE):
+    """Collections, then items (server-side cursor, field data and parents per chunk)."""
+    collection_rows = get_collection_rows(library_id)
+    yield from collection_rows.values()
+
+    field_names = set(terms.values())
+    stmt = (
+        select(
+            Item.id,
+            Item.name,
+            Item.name_zh,
+            Item.source_data,
+        )
+        .where(Item.library_id == library_id)
+        .order_by(Item.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    for items in session.execute(stmt).partitions():
+        item_ids = [x.id for x in items]
+        parents = {}
+        for item_id, collection_id in session.execute(
+            select(
+                CollectionItem.item_id,
+                CollectionItem.collection_id,
+            )
+            .where(CollectionItem.item_id.in_(item_ids))
+            .order_by(CollectionItem.id)
+        ):
+            parents.setdefault(item_id, collection_id)
+
+        values = {}
+        if field_names:
+            for item_id, name, value in session.execute(
+                select(
+                    ItemData.item_id,
+                    Field.name,
+                    ItemData.value,
+                )
+                .join(
+                    Field,
+                    Field.id == ItemData.field_id,
+                )
+                .where(
+                    ItemData.item_id.in_(item_ids),
+                    Field.name.in_(field_names),
+                )
+            ):
+                values.setdefault(item_id, {})[name] = value
+
+        for x in items:
+            parent = collection_rows.get(parents.get(x.id))
+            row = {rank: parent[rank] for rank in HIGHER_RANKS} if parent else {}
+            row.update({
+                'taxonID': str(x.id), # Item.key is shared by the records of a species
+                'parentNameUsageID': parent['taxonID'] if parent else '',
+                'scientificName': x.name,
+                'vernacularName': x.name_zh,
+                'taxonRank': 'species',
+                'dynamicProperties': json.dumps(x.source_data, ensure_ascii=False) if x.source_data else '',
+            })
+            source_data = x.source_data or {}
+            item_values = values.get(x.id, {})
+            for term, name in terms.items():
+                row[term] = item_values.get(name, source_data.get(name))
+            yield row
+
+
+def write_dwca(path, library_id, terms):
+    columns = list(CORE_TERMS) + [x for x in terms if x not in CORE_TERMS] + ['dynamicProperties']
+    fields = '\n'.join(f'    <field index="{i}" term="{DWC_NS}{term}"/>' for i, term in enumerate(columns) if i > 0)
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('meta.xml', META_XML.format(fields=fields))
+        with zf.open('taxon.txt', 'w', force_zip64=True) as raw:
+            f = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+            f.write('\t'.join(columns) + '\n')
+            for row in iter_taxon_rows(library_id, terms):
+                f.write('\t'.join(clean(row.get(x)) for x in columns) + '\n')
+            f.flush()
+            f.detach()
+
+
+def get_dwca_path(library):
+    return Path(current_app.config['EXPORT_FOLDER'], f'{library.name}-dwca-{library.data_version}.zip')
+
+
+def get_latest_dwca_path(library):
+    """Newest archive on disk (a previous data version while the next is built), None: never built."""
+    versions = {}
+    for x in Path(current_app.config['EXPORT_FOLDER']).glob(f'{library.name}-dwca-*.zip'):
+        if (version := x.stem.rsplit('-', 1)[-1]).isdigit():
+            versions[int(version)] = x
+    return versions[max(versions)] if versions else None
+
+
+def build_dwca(library_id):
+    """Path of the archive of the current data version, built when missing.
+
+    None: another process is building it.
+    """
+    library = session.get(Library, library_id)
+    path = get_dwca_path(library)
+    if path.exists():
+        return path
+    lock_key = f'lib-{library_id}-dwca-{library.data_version}-lock'
+    if not lock_cache(lock_key, 3600):
+        return None
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix='.zip', dir=path.parent)
+    os.close(fd)
+    try:
+        write_dwca(tmp_path, library_id, dwc_terms(read_config(library.name)))
+        os.replace(tmp_path, path) # downloads never see a partial file
+    except Exception:
+        delete_cache(lock_key)
+        raise
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+    for x in path.parent.glob(f'{library.name}-dwca-*.zip'):
+        if x != path:
+            x.unlink(missing_ok=True)
+    return path
@@ -0,0 +1,160 @@
+"""Query plan regression check of the hot statements (flask explaincheck).
+
+Builds the statements of the listing, search, collection filter, facets,
+collection tree and item detail for a library with sample values from the
+database, EXPLAINs them (the real statement and parameters, rewritten in
+before_cursor_execute) and reports Seq Scans on tables with at least
+min_rows rows. The tables are ANALYZEd first: a fresh seed has no
+statistics (reltuples -1), so plans and row counts would be meaningless.
+Run it against a seeded local DB, e.g. after
+`python scripts/benchmark.py --items 50000 --keep`.
+"""
+from sqlalchemy import (
+    select,
+    event,
+    text,
+)
+
+from app.models import (
+    Item,
+    ItemData,
+    ItemNote,
+    ItemAttachment,
+    ItemTypeField,
+    Field,
+    Library,
+    Collection,
+    CollectionItem,
+    CollectionClosure,
+)
+from app.database import session
+from app.helpers.library import get_config
+from app.helpers.collection import get_levels, make_collection_tree_stmts
+from app.helpers.item import (
+    make_item_rows_stmt,
+    make_count_stmt,
+    facet_keys,
+    make_facet_counts_stmt,
+    make_item_detail_stmts,
+)
+
+PAGE_SIZE = 20
+# tables the hot statements read
+TABLES = [x.__tablename__ for x in (
+    Item,
+    ItemData,
+    ItemNote,
+    ItemAttachment,
+    ItemTypeField,
+    Field,
+    Library,
+    Collection,
+    CollectionItem,
+    CollectionClosure,
+)]
+
+
+def get_hot_statements(library_id):
+    """{name: statement} of the request paths, sample values from the library."""
+    config = get_config(library_id)
+    sample = session.execute(
+        select(
+            Item.id,
+            Item.name,
+            Item.source_data,
+        )
+        .where(Item.library_id == library_id)
+        .order_by(Item.id.desc())
+        .limit(1)
+    ).first()
+    if not sample:
+        return {}
+    collection_id = session.execute(
+        select(CollectionItem.collection_id).where(CollectionItem.item_id == sample.id)
+    ).scalar()
+
+    listing = make_item_rows_stmt(library_id, {})
+    stmts = {
+        'items_page': listing.limit(PAGE_SIZE),
+        'items_count': make_count_stmt(listing),
+        'items_search': make_item_rows_stmt(library_id, {'q': sample.name.split()[0][:4]}).limit(PAGE_SIZE),
+    }
+    if collection_id:
+        path = session.execute(select(Collection.path).where(Collection.id == collection_id)).scalar()
+        root_id = path.strip('/').split('/')[0] if path else collection_id
+        stmts['items_collection'] = make_item_rows_stmt(library_id, {'collection_id': root_id}).limit(PAGE_SIZE)
+        stmts['items_collection_leaf'] = make_item_rows_stmt(library_id, {'collection_id': collection_id}).limit(PAGE_SIZE)
+    if keys := facet_keys(config):
+        filtr = {}
+        if (value := (sample.source_data or {}).get(keys[0])) is not None:
+            filtr = {'facets': {keys[0]: [str(value)]}}
+            stmts['items_facet_filter'] = make_item_rows_stmt(library_id, filtr).limit(PAGE_SIZE)
+        stmts['facet_counts'] = make_facet_counts_stmt(library_id, filtr, keys)
+    if config:
+        for key, stmt in make_collection_tree_stmts(library_id, get_levels(config), 2).items():
+            stmts[f'collections_{key}'] = stmt
+    for key, stmt in make_item_detail_stmts([sample.id]).items():
+        stmts[f'detail_{key}'] = stmt
+    return stmts
+
+
+def explain(stmt):
+    """EXPLAIN (FORMAT JSON) plan of stmt, as psycopg2 parses it."""
+    conn = session.connection()
+
+    def to_explain(conn, cursor, statement, parameters, context, executemany):
+        return f'EXPLAIN (FORMAT JSON) {statement}', parameters
+
+    event.listen(conn, 'before_cursor_execute', to_explain, retval=True)
+    try:
+        # raw cursor: the result columns don't match the statement's
+        result = conn.execute(stmt)
+        plan = result.cursor.fetchone()[0][0]
+        result.close()
+        return plan
+    finally:
+        event.remove(conn, 'before_cursor_execute', to_explain)
+
+
+def iter_nodes(node):
+    yield node
+    for x in node.get('Plans', []):
+        yield from iter_nodes(x)
+
+
+def get_table_rows(tables):
+    if not tables:
+        return {}
+    rows = session.execute(
+        text('SELECT relname, reltuples FROM pg_class WHERE relkind = \'r\' AND relname = ANY(:names)'),
+        {'names': list(tables)},
+    )
+    return {name: int(num) for name, num in rows}
+
+
+def analyze_tables():
+    for x in TABLES:
+        session.execute(text(f'ANALYZE {x}'))
+    session.commit()
+
+
+def check_plans(library_id, min_rows=10000, analyze=True):
+    """[(name, plan, problems)], problems: 'Seq Scan on table (rows)'."""
+    if analyze:
+        analyze_tables()
+    plans = {name: explain(stmt) for name, stmt in get_hot_statements(library_id).items()}
+    scans = {
+        name: [x['Relation Name'] for x in iter_nodes(plan['Plan']) if x['Node Type'] == 'Seq Scan']
+        for name, plan in plans.items()
+    }
+    table_rows = get_table_rows({x for tables in scans.values() for x in tables})
+
+    results = []
+    for name, plan in plans.items():
+        problems = [
+            f'Seq Scan on {x} ({table_rows.get(x, 0)} rows)'
+            for x in dict.fromkeys(scans[name]) if table_rows.get(x, 0) >= min_rows
+        ]
+        results.append((name, plan, problems))
+    session.rollback()
+    return results
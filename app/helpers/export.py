@@ -0,0 +1,125 @@
+import io
+import csv
+import json
+
+from sqlalchemy import select, func
+
+from app.models import (
+    Item,
+    ItemData,
+    ItemTypeField,
+    Field,
+)
+from app.database import session
+from app.helpers.item import (
+    make_items_stmt,
+    make_ancestors_stmt,
+    group_ancestors,
+)
+
+EXPORT_CHUNK = 1000
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def iter_export_records(library_id, chunk_size=EXPORT_CHUNK):
+    """Every listed item of a library with field values, source_data and ancestor path.
+
+    Items come from a server-side cursor (yield_per), field values and ancestors
+    are loaded per chunk with one query each, so memory stays constant.
+    """
+    stmt = (
+        make_items_stmt(
+            library_id,
+            {},
+            Item.id,
+            Item.name,
+            Item.name_zh,
+            Item.source_data,
+        )
+        .order_by(Item.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    for items in session.execute(stmt).partitions():
+        item_ids = [x.id for x in items]
+
+        values = {}
+        stmt_d = (
+            select(
+                ItemData.item_id,
+                Field.name,
+                ItemData.value,
+            )
+            .join(
+                Field,
+                Field.id == ItemData.field_id,
+            )
+            .where(ItemData.item_id.in_(item_ids))
+            .order_by(ItemData.id)
+        )
+        for item_id, name, value in session.execute(stmt_d):
+            values.setdefault(item_id, {})[name] = value
+        ancestors = group_ancestors(session.execute(make_ancestors_stmt(item_ids)))
+
+        for x in items:
+            yield {
+                'id': x.id,
+                'name': x.name,
+                'name_zh': x.name_zh,
+                'path': [c['name'] for c in ancestors.get(x.id, [])],
+                'fields': values.get(x.id, {}),
+                'source_data': x.source_data,
+            }
+
+
+def get_export_field_names(library_id):
+    """Field names of the library item types, the CSV columns."""
+    item_type_ids = select(Item.item_type_id).where(Item.library_id == library_id).distinct()
+    stmt = (
+        select(
+            Field.name,
+        )
+        .join(
+            ItemTypeField,
+            ItemTypeField.field_id == Field.id,
+        )
+        .where(ItemTypeField.item_type_id.in_(item_type_ids))
+        .group_by(Field.name)
+        .order_by(func.min(ItemTypeField.sort))
+    )
+    return session.execute(stmt).scalars().all()
+
+
+def iter_ndjson(library_id):
+    for record in iter_export_records(library_id):
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def iter_csv(library_id):
+    field_names = get_export_field_names(library_id)
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    writer.writerow(['id', 'name', 'name_zh', 'path'] + field_names + ['source_data'])
+    num = 0
+    for record in iter_export_records(library_id):
+        writer.writerow(
+            [record['id'], record['name'], record['name_zh'], ' > '.join(record['path'])]
+            + [record['fields'].get(x, '') for x in field_names]
+            + [json.dumps(record['source_data'], ensure_ascii=False)]
+        )
+        num += 1
+        # send in blocks, not one write per row
+        if num % 100 == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def iter_export(library_id, fmt='ndjson'):
+    if fmt == 'csv':
+        return iter_csv(library_id)
+    return iter_ndjson(library_id)
@@ -1,70 +1,247 @@
+import re
+
 from sqlalchemy import (
     select,
+    update,
     func,
     or_,
+    and_,
+    true,
 )
 
 from app.models import (
     Item,
     ItemData,
+    ItemNote,
+    ItemAttachment,
+    ItemTypeField,
+    Field,
+    Library,
+    Collection,
     CollectionClosure,
     CollectionItem,
 )
 from app.database import session
+from app.helpers.bbcode import bbcode_to_html, render_bbcode, DEFAULT_STORAGE_URL
+from app.helpers.search import make_search_condition
+from app.helpers.library import (
+    get_config,
+    read_config,
+    get_storage_config,
+    storage_config,
+)
 
-def get_items(library_id, filtr={}, limit=0, offset=0):
+# field values displayed with the bbcode filter (item_detail.html)
+BBCODE_FIELDS = ('source_data',)
 
+MAX_FACETS = 10
+FACET_VALUE_LIMIT = 50
+MAX_CACHED_QUERY = 50
+CACHED_QUERIES = 100 # only the top ranked searches are cached
+MAX_BATCH_ITEMS = 200
+
+# statements are built without touching the db, so the sync views and the
+# async api (app.async_api) share them and only differ in how they execute.
+
+def make_subtree_condition(collection_id):
+    """Collections under collection_id (itself included), a range on ix_collection_path."""
+    path = select(Collection.path).where(Collection.id == collection_id).scalar_subquery()
+    return and_(
+        Collection.path >= path,
+        Collection.path < path + '~', # '~' sorts after '/' and digits
+    )
+
+
+def make_items_stmt(library_id, filtr, *columns):
+    """Listing select() with library rules and filters applied, on the given columns/entity."""
     stmt = (
         select(
-            Item
-        )
-        .join(
-            ItemData,
-            ItemData.item_id == Item.id,
+            *columns
         )
         .where(
             Item.library_id == library_id,
+            Item.is_visible, # library [visibility] rule, see update_visibility
         )
     )
-    ## TODO!
-    if library_id == 1:
-        stmt = stmt.where(
-            ItemData.value == '1',
-            ItemData.field_id == 1
-        )
-
 
     if q := filtr.get('q'):
-        stmt = stmt.where(or_(
-            Item.name.ilike(f'%{q}%'),
-            Item.name_zh.ilike(f'%{q}%'),
-        ))
+        # search_doc @@ tsquery, uses ix_item_search_doc (GIN)
+        stmt = stmt.where(make_search_condition(q))
     if collection_id := filtr.get('collection_id'):
-        stmt_c = (
-            select(
-                CollectionClosure.descendant_id
-            )
-            .where(
-                CollectionClosure.ancestor_id == collection_id
-            )
-        )
-        collection_ids = session.execute(stmt_c).scalars().all()
+        # items in the collection or any of its descendants
         stmt_i = (
             select(
                 CollectionItem.item_id,
             )
+            .join(
+                Collection,
+                Collection.id == CollectionItem.collection_id,
+            )
             .where(
-                CollectionItem.collection_id.in_(collection_ids)
+                make_subtree_condition(collection_id)
             )
         )
-        item_ids = session.execute(stmt_i).scalars().all()
-        if len(item_ids):
-            stmt = stmt.where(Item.id.in_(item_ids))
+        stmt = stmt.where(Item.id.in_(stmt_i))
+    if facets := filtr.get('facets'):
+        # source_data @> '{"key": "value"}', uses ix_item_source_data (GIN)
+        for key, values in facets.items():
+            stmt = stmt.where(or_(*[Item.source_data.contains({key: v}) for v in values]))
+
+    return stmt
+
+
+def make_count_stmt(stmt):
+    subquery = stmt.subquery()
+    return select(func.count()).select_from(subquery)
+
+
+def count_items(stmt):
+    return session.execute(make_count_stmt(stmt)).scalar()
+
+
+def make_item_rows_stmt(library_id, filtr):
+    """Only the columns a listing needs, name_zh_other and status_id are the
+    raw source_data values (-> operator)."""
+    return make_items_stmt(
+        library_id,
+        filtr,
+        Item.id,
+        Item.name,
+        Item.name_zh,
+        Item.source_data['Chinese_name_other'].label('name_zh_other'),
+        Item.source_data['status_id'].label('status_id'),
+    )
+
+
+def parse_items_args(args):
+    """Listing filter, limit, offset from request args.
+
+    Raises ValueError: collection_id is not an integer.
+    """
+    filtr = {}
+    if q := args.get('q', ''):
+        filtr['q'] = q
+    if args.get('collection_id', ''):
+        # asyncpg does not cast a str parameter to int
+        if (collection_id := args.get('collection_id', type=int)) is None:
+            raise ValueError('collection_id is not an integer')
+        filtr['collection_id'] = collection_id
+    # ?facet.status_id=1&facet.is_accepted=1 (repeat a key for OR)
+    facets = {}
+    for key in args:
+        if key.startswith('facet.') and len(key) > 6:
+            if values := [x for x in args.getlist(key) if x != '']:
+                facets[key[6:]] = values
+    if facets:
+        filtr['facets'] = facets
+
+    limit = args.get('limit', 20, type=int)
+    offset = args.get('offset', 0, type=int)
+    return filtr, limit, offset
+
+
+def parse_item_ids(args, limit=MAX_BATCH_ITEMS):
+    """Item ids of a batch request, ?ids=1,2,3 (or repeated), unique in request order.
+
+    Stops after limit + 1 ids, enough for the caller to reject the request.
+    """
+    item_ids = {} # dict: ordered set
+    for value in args.getlist('ids'):
+        for x in value.split(','):
+            if re.fullmatch(r'\d+', x := x.strip(), re.ASCII):
+                item_ids[int(x)] = None
+                if len(item_ids) > limit:
+                    return list(item_ids)
+    return list(item_ids)
+
+
+def is_plain_search(filtr):
+    """Only a (short) q, the searches ranked and cached."""
+    return list(filtr) == ['q'] and len(filtr['q']) <= MAX_CACHED_QUERY
+
+
+def make_items_cache_key(library_id, filtr, limit, offset, top_query=False):
+    """Cache key of api_items, None: not cached (only the plain listing and the
+    plain searches in the top CACHED_QUERIES, top_query, are)."""
+    if len(filtr) == 0:
+        return f'lib-{library_id}-items-{limit}-{offset}'
+    if top_query and is_plain_search(filtr):
+        return f'lib-{library_id}-items-q:{filtr["q"]}-{limit}-{offset}'
+    return None
+
+
+def facet_keys(config):
+    """Facet keys to count: [facet] fields in library config (a key only
+    filtered on is not counted)."""
+    keys = []
+    if config and config.has_section('facet'):
+        keys = [x.strip() for x in config.get('facet', 'fields', fallback='').split(',') if x.strip()]
+    return keys[:MAX_FACETS]
+
+
+def get_facet_keys(library_id):
+    return facet_keys(get_config(library_id))
+
 
-    base_stmt = stmt
-    subquery = base_stmt.subquery()
-    count_stmt = select(func.count()).select_from(subquery)
-    total = session.execute(count_stmt).scalar()
+def make_facet_counts_stmt(library_id, filtr, keys):
+    """Count source_data values of keys over the filtered items, in one query,
+    top FACET_VALUE_LIMIT values per key."""
+    base = make_items_stmt(library_id, filtr, Item.source_data).subquery()
+    kv = func.jsonb_each_text(base.c.source_data).table_valued('key', 'value')
+    num = func.count()
+    counts = (
+        select(
+            kv.c.key,
+            kv.c.value,
+            num.label('num'),
+            func.row_number().over(
+                partition_by=kv.c.key,
+                order_by=num.desc(),
+            ).label('rank'),
+        )
+        .select_from(base)
+        .join(
+            kv,
+            true(),
+        )
+        .where(
+            kv.c.key.in_(keys)
+        )
+        .group_by(
+            kv.c.key,
+            kv.c.value,
+        )
+        .subquery()
+    )
+    return (
+        select(
+            counts.c.key,
+            counts.c.value,
+            counts.c.num,
+        )
+        .where(counts.c.rank <= FACET_VALUE_LIMIT)
+        .order_by(counts.c.num.desc())
+    )
+
+
+def group_facet_counts(rows, keys):
+    """Returns: {key: [{'value': v, 'count': n}, ...]} sorted by count"""
+    facets = {key: [] for key in keys}
+    for key, value, count in rows:
+        facets[key].append({'value': value, 'count': count})
+    return facets
+
+
+def get_facet_counts(library_id, filtr, keys):
+    if not keys:
+        return {}
+    rows = session.execute(make_facet_counts_stmt(library_id, filtr, keys))
+    return group_facet_counts(rows, keys)
+
+
+def get_items(library_id, filtr={}, limit=0, offset=0):
+    base_stmt = make_items_stmt(library_id, filtr, Item)
+    total = count_items(base_stmt)
     stmt = base_stmt.limit(limit).offset(offset)
     items = session.execute(stmt).scalars().all()
 
@@ -72,3 +249,412 @@ def get_items(library_id, filtr={}, limit=0, offset=0):
         'items': items,
         'total': total,
     }
+
+
+def get_item_rows(library_id, filtr={}, limit=0, offset=0):
+    """Same as get_items, but plain rows of make_item_rows_stmt columns, no ORM
+    entities, so no identity map and no selectin relationship loading.
+    """
+    base_stmt = make_item_rows_stmt(library_id, filtr)
+    total = count_items(base_stmt)
+    stmt = base_stmt.limit(limit).offset(offset)
+    rows = session.execute(stmt).all()
+
+    return {
+        'items': rows,
+        'total': total,
+    }
+
+
+def make_items_data(rows, total, facets=None):
+    """JSON of api_items."""
+    data = {
+        'items': [],
+        'total': total,
+    }
+
+    for row in rows:
+        #TODO
+        name_zh_other = row.name_zh_other or ''
+        status_id = '1'
+        if row.status_id:
+            status_id = 1
+        data['items'].append({
+            'id': row.id,
+            'name': row.name,
+            'name_zh': row.name_zh,
+            'name_zh_other': name_zh_other,
+            'status_id': status_id,
+        })
+
+    if facets:
+        data['facets'] = facets
+
+    return data
+
+
+def get_items_data(library_id, filtr, limit, offset):
+    results = get_item_rows(library_id, filtr, limit, offset)
+    facets = None
+    if keys := get_facet_keys(library_id):
+        facets = get_facet_counts(library_id, filtr, keys)
+    return make_items_data(results['items'], results['total'], facets)
+
+
+def make_item_detail_stmts(item_ids):
+    """One set-based query per part of the item details, for any number of items."""
+    item_type_ids = select(Item.item_type_id).where(Item.id.in_(item_ids))
+    library_ids = select(Item.library_id).where(Item.id.in_(item_ids))
+    return {
+        'items': (
+            select(
+                Item.id,
+                Item.name,
+                Item.name_zh,
+                Item.library_id,
+                Item.item_type_id,
+                Item.source_data,
+            )
+            .where(Item.id.in_(item_ids))
+        ),
+        'libraries': (
+            select(
+                Library.id,
+                Library.name,
+            )
+            .where(Library.id.in_(library_ids))
+        ),
+        'fields': (
+            select(
+                ItemTypeField.item_type_id,
+                ItemTypeField.control_id,
+                Field.id,
+                Field.name,
+                Field.label,
+            )
+            .join(
+                Field,
+                Field.id == ItemTypeField.field_id,
+            )
+            .where(ItemTypeField.item_type_id.in_(item_type_ids))
+            .order_by(ItemTypeField.sort, ItemTypeField.id)
+        ),
+        'data': (
+            select(
+                ItemData.item_id,
+                ItemData.field_id,
+                ItemData.value,
+                ItemData.value_html,
+            )
+            .where(ItemData.item_id.in_(item_ids))
+            .order_by(ItemData.id)
+        ),
+        'attachments': (
+            select(
+                ItemAttachment.id,
+                ItemAttachment.item_id,
+                ItemAttachment.mimetype,
+                ItemAttachment.path,
+                ItemAttachment.derivatives,
+            )
+            .where(ItemAttachment.item_id.in_(item_ids))
+            .order_by(ItemAttachment.id)
+        ),
+        'notes': (
+            select(
+                ItemNote.id,
+                ItemNote.item_id,
+                ItemNote.parent_id,
+                ItemNote.title,
+                ItemNote.note,
+                ItemNote.note_html,
+            )
+            .where(ItemNote.item_id.in_(item_ids))
+            .order_by(ItemNote.id)
+        ),
+        'ancestors': make_ancestors_stmt(item_ids),
+    }
+
+
+def make_ancestors_stmt(item_ids):
+    """Collections containing the items and their ancestors, top first per collection."""
+    return (
+        select(
+            CollectionItem.item_id,
+            CollectionItem.collection_id,
+            Collection.id,
+            Collection.name,
+            Collection.name_zh,
+            Collection.level,
+        )
+        .join(
+            CollectionClosure,
+            CollectionClosure.descendant_id == CollectionItem.collection_id,
+        )
+        .join(
+            Collection,
+            Collection.id == CollectionClosure.ancestor_id,
+        )
+        .where(CollectionItem.item_id.in_(item_ids))
+        .order_by(CollectionItem.item_id, CollectionItem.id, CollectionClosure.depth.desc())
+    )
+
+
+def group_ancestors(rows):
+    """Same as Item.higher_collections: ancestors of the first collection only.
+
+    Returns: {item_id: [{'id', 'name', 'name_zh', 'level'}, ...]}
+    """
+    ancestors = {}
+    first_collection = {}
+    for x in rows:
+        if first_collection.setdefault(x.item_id, x.collection_id) == x.collection_id:
+            ancestors.setdefault(x.item_id, []).append({
+                'id': x.id,
+                'name': x.name,
+                'name_zh': x.name_zh,
+                'level': x.level,
+            })
+    return ancestors
+
+
+def attachment_url(attachment, storage_url, size=None):
+    """Url of a derivative size (app.helpers.derivative), the original when size is None or not generated."""
+    if size and (x := (attachment.derivatives or {}).get(size)):
+        return f'{storage_url}{x["path"]}'
+    return f'{storage_url}{attachment.path}'
+
+
+def make_item_details(item_ids, results):
+    """Assemble item detail JSON from the rows of make_item_detail_stmts, in item_ids order."""
+    configs = {x.id: read_config(x.name) for x in results['libraries']}
+
+    type_fields = {}
+    for x in results['fields']:
+        type_fields.setdefault(x.item_type_id, []).append(x)
+    values = {}
+    for x in results['data']:
+        values.setdefault(x.item_id, {})[x.field_id] = x
+    attachments = {}
+    for x in results['attachments']:
+        attachments.setdefault(x.item_id, []).append(x)
+    notes = {}
+    for x in results['notes']:
+        notes.setdefault(x.item_id, []).append(x)
+    ancestors = group_ancestors(results['ancestors'])
+
+    details = {}
+    for item in results['items']:
+        config = configs.get(item.library_id)
+        storage = storage_config(config)
+        storage_url = storage['full_url'] if storage else DEFAULT_STORAGE_URL
+        source_fields = {}
+        if config and 'item_source_data_field' in config:
+            source_fields = config['item_source_data_field']
+
+        # same rules as Item.field_data
+        field_data = []
+        item_values = values.get(item.id, {})
+        for m in type_fields.get(item.item_type_id, []):
+            value = ''
+            value_html = None
+            if x := item_values.get(m.id):
+                value = x.value
+                value_html = x.value_html
+            for key, field_id in source_fields.items():
+                if str(field_id) == str(m.id):
+                    if x := (item.source_data or {}).get(key):
+                        value = x
+                        value_html = None # not pre-rendered
+                        break
+            field_data.append({
+                'id': m.id,
+                'name': m.name,
+                'label': m.label,
+                'value': value,
+                'value_html': value_html,
+                'control_id': m.control_id,
+            })
+
+        details[item.id] = {
+            'id': item.id,
+            'name': item.name,
+            'name_zh': item.name_zh,
+            'library_id': item.library_id,
+            'source_data': item.source_data,
+            'field_data': field_data,
+            'higher_collections': ancestors.get(item.id, []),
+            'attachments': [{
+                'id': x.id,
+                'mimetype': x.mimetype,
+                'path': x.path,
+                'url': attachment_url(x, storage_url),
+                # generated sizes only, e.g. {'thumb': url, 'web': url}
+                'sizes': {size: attachment_url(x, storage_url, size) for size in x.derivatives or {}},
+            } for x in attachments.get(item.id, [])],
+            'notes': [{
+                'id': x.id,
+                'parent_id': x.parent_id,
+                'title': x.title,
+                'note_html': x.note_html if x.note_html is not None else bbcode_to_html(x.note, storage_url),
+            } for x in notes.get(item.id, [])],
+        }
+
+    return [details[x] for x in item_ids if x in details]
+
+
+def get_item_details(item_ids):
+    stmts = make_item_detail_stmts(item_ids)
+    results = {key: session.execute(stmt).all() for key, stmt in stmts.items()}
+    return make_item_details(item_ids, results)
+
+
+def join_item_details(item_ids, payloads):
+    """Batch response body from the serialized details ({item_id: payload}), in item_ids order, unknown ids dropped."""
+    return b'{"items": [' + b', '.join(payloads[x]['identity'] for x in item_ids if x in payloads) + b']}'
+
+
+def bump_item_versions(item_ids):
+    """Item.version + 1 (and updated_at) of items whose page changed, no commit.
+
+    build_static re-renders pages by version.
+    """
+    if item_ids:
+        session.execute(
+            update(Item)
+            .where(Item.id.in_(list(item_ids)))
+            .values(version=Item.version + 1)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def visibility_config(config):
+    """Library ini rule for listed items, None: all items are listed.
+
+        [visibility]
+        # ItemData field name (field = ...) or source_data key
+        source_data = is_accepted
+        # comma separated
+        values = 1
+    """
+    if config and config.has_section('visibility'):
+        values = [x.strip() for x in config.get('visibility', 'values', fallback='1').split(',')]
+        if x := config.get('visibility', 'field', fallback=None):
+            return {'field': x, 'values': values}
+        if x := config.get('visibility', 'source_data', fallback=None):
+            return {'source_data': x, 'values': values}
+    return None
+
+
+def make_visibility_stmt(library_id, rule):
+    """UPDATE item.is_visible of a library from the rule, one statement."""
+    if rule and 'field' in rule:
+        visible = (
+            select(
+                ItemData.id,
+            )
+            .join(
+                Field,
+                Field.id == ItemData.field_id,
+            )
+            .where(
+                ItemData.item_id == Item.id,
+                Field.name == rule['field'],
+                ItemData.value.in_(rule['values']),
+            )
+            .exists()
+        )
+    elif rule:
+        visible = func.coalesce(Item.source_data[rule['source_data']].astext.in_(rule['values']), False)
+    else:
+        visible = true()
+    return (
+        update(Item)
+        .where(Item.library_id == library_id)
+        .values(is_visible=visible)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def get_visibility_rule(library_id, reset=False):
+    """The library [visibility] rule.
+
+    Raises ValueError when there is no rule but some items are hidden (ini not
+    deployed, section dropped): listing them all again needs reset=True.
+    """
+    rule = visibility_config(get_config(library_id))
+    if rule is None and not reset:
+        hidden = session.execute(
+            select(Item.id)
+            .where(
+                Item.library_id == library_id,
+                Item.is_visible.is_(False),
+            )
+            .limit(1)
+        ).first()
+        if hidden:
+            raise ValueError(f'library {library_id} has hidden items but no [visibility] rule, add it or reset')
+    return rule
+
+
+def update_visibility(library_id, reset=False):
+    """Materialize the library [visibility] rule into item.is_visible, run after import."""
+    result = session.execute(make_visibility_stmt(library_id, get_visibility_rule(library_id, reset)))
+    session.commit()
+    return result.rowcount
+
+
+def render_item_html(library_id, only_missing=True):
+    """Store rendered BBCode of notes and BBCODE_FIELDS values, so item pages
+    don't convert them on every view.
+
+    Args:
+        library_id: library to render
+        only_missing: skip rows already rendered (False: re-render all, e.g. storage url changed)
+    """
+    storage = get_storage_config(library_id)
+    storage_url = storage['full_url'] if storage else DEFAULT_STORAGE_URL
+
+    stmt_n = (
+        select(
+            ItemNote
+        )
+        .join(
+            Item,
+            Item.id == ItemNote.item_id,
+        )
+        .where(
+            Item.library_id == library_id,
+        )
+    )
+    stmt_d = (
+        select(
+            ItemData
+        )
+        .join(
+            Item,
+            Item.id == ItemData.item_id,
+        )
+        .join(
+            Field,
+            Field.id == ItemData.field_id,
+        )
+        .where(
+            Item.library_id == library_id,
+            Field.name.in_(BBCODE_FIELDS),
+        )
+    )
+    if only_missing:
+        stmt_n = stmt_n.where(ItemNote.note_html.is_(None))
+        stmt_d = stmt_d.where(ItemData.value_html.is_(None))
+
+    count = 0
+    for note in session.execute(stmt_n.execution_options(yield_per=500)).scalars():
+        note.note_html = render_bbcode(note.note, storage_url) if note.note else ''
+        count += 1
+    for item_data in session.execute(stmt_d.execution_options(yield_per=500)).scalars():
+        item_data.value_html = render_bbcode(item_data.value, storage_url) if item_data.value else ''
+        count += 1
+    session.commit()
+
+    return count
@@ -0,0 +1,68 @@
+"""JSON provider: orjson when installed (JSON_PROVIDER=auto|orjson|stdlib), stdlib fallback.
+
+Both write UTF-8 bytes directly (dumps_bytes, used for the cached payloads)
+and handle the UUID/datetime columns of SyncMixin and TimestampMixin
+(ISO 8601, not Flask's HTTP date format).
+"""
+import json
+import uuid
+import decimal
+from datetime import date, datetime
+
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def default(obj):
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, (uuid.UUID, decimal.Decimal)):
+        return str(obj)
+    if hasattr(obj, '__html__'): # markupsafe.Markup
+        return str(obj.__html__())
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def use_orjson(backend='auto'):
+    if backend == 'orjson' and orjson is None:
+        raise RuntimeError('JSON_PROVIDER=orjson but orjson is not installed')
+    return orjson is not None and backend != 'stdlib'
+
+
+def dumps_bytes(obj, backend='auto'):
+    if use_orjson(backend):
+        # UUID, datetime natively; default for the rest
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class FastJSONProvider(JSONProvider):
+    mimetype = 'application/json'
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.backend = app.config.get('JSON_PROVIDER', 'auto')
+
+    def dumps_bytes(self, obj):
+        return dumps_bytes(obj, self.backend)
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # options of the stdlib (indent, sort_keys...)
+            kwargs.setdefault('default', default)
+            kwargs.setdefault('ensure_ascii', False)
+            return json.dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if use_orjson(self.backend) and not kwargs:
+            return orjson.loads(s)
+        return json.loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(self.dumps_bytes(obj), mimetype=self.mimetype)
@@ -2,17 +2,31 @@ from pathlib import Path
 import configparser
 
 from flask import current_app
+from sqlalchemy import update
 
 from app.models import Library
 from app.database import session
 
+def read_config(library_name):
+    conf_path = Path('app', 'settings', f'{library_name}.ini')
+    config = configparser.ConfigParser()
+    config.optionxform = str # case-sensitive
+    config.read(conf_path)
+    return config
+
+
 def get_config(library_id):
     if lib := session.get(Library, library_id):
-        conf_path = Path('app', 'settings', f'{lib.name}.ini')
-        config = configparser.ConfigParser()
-        config.optionxform = str # case-sensitive
-        config.read(conf_path)
-        return config
+        return read_config(lib.name)
+
+
+def bump_data_version(library_id):
+    session.execute(
+        update(Library)
+        .where(Library.id == library_id)
+        .values(data_version=Library.data_version + 1)
+    )
+    session.commit()
 
 
 def get_library(request):
@@ -30,7 +44,10 @@ def get_library(request):
 
 def get_web_analytics(library_id):
     """Get web analytics configuration for a library."""
-    config = get_config(library_id)
+    return web_analytics_config(get_config(library_id))
+
+
+def web_analytics_config(config):
     if config and config.has_section('web_analytics'):
         return {
             'type': config.get('web_analytics', 'type', fallback=None),
@@ -41,7 +58,10 @@ def get_web_analytics(library_id):
 
 def get_storage_config(library_id):
     """Get storage configuration for a library."""
-    config = get_config(library_id)
+    return storage_config(get_config(library_id))
+
+
+def storage_config(config):
     if config and config.has_section('storage'):
         bucket = config.get('storage', 'bucket', fallback='')
         url = config.get('storage', 'url', fallback='')
@@ -0,0 +1,163 @@
+"""In-process metrics, aggregated across workers in Redis, Prometheus text output.
+
+Every process counts into its own registry and periodically adds it to one
+Redis hash (HINCRBYFLOAT), fields are the Prometheus series names, so all
+gunicorn workers (and CLI imports) sum up without a shared directory.
+"""
+import time
+import threading
+from collections import Counter
+
+from flask import (
+    g,
+    request,
+    Response,
+    abort,
+)
+
+from app.helpers.profiler import listen_engines, start_request_stats
+
+REDIS_KEY = 'metrics'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# name: (type, help)
+METRICS = {
+    'http_request_duration_seconds': ('histogram', 'Request latency by endpoint'),
+    'http_response_size_bytes': ('histogram', 'Response body size by endpoint'),
+    'http_requests_total': ('counter', 'Requests by endpoint and status'),
+    'db_duration_seconds': ('histogram', 'Database time per request by endpoint'),
+    'db_queries_total': ('counter', 'Queries by endpoint'),
+    'cache_requests_total': ('counter', 'Cache lookups by namespace and result (hit/miss)'),
+    'import_items_total': ('counter', 'Items imported by library'),
+    'import_duration_seconds': ('counter', 'Time spent importing by library'),
+}
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def series(name, labels):
+    if not labels:
+        return name
+    pairs = ','.join(f'{k}="{escape(v)}"' for k, v in labels)
+    return f'{name}{{{pairs}}}'
+
+
+class MetricsRegistry(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = Counter() # series: value
+        self.last_flush = time.monotonic()
+
+    def inc(self, name, labels=None, value=1):
+        key = series(name, tuple(sorted((labels or {}).items())))
+        with self.lock:
+            self.values[key] += value
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        """Histogram: cumulative buckets + _sum + _count."""
+        labels = tuple(sorted((labels or {}).items()))
+        keys = [series(f'{name}_bucket', labels + (('le', str(b)),)) for b in buckets if value <= b]
+        keys.append(series(f'{name}_bucket', labels + (('le', '+Inf'),)))
+        with self.lock:
+            for key in keys:
+                self.values[key] += 1
+            self.values[series(f'{name}_sum', labels)] += value
+            self.values[series(f'{name}_count', labels)] += 1
+
+    def flush(self, redis_client, interval=0):
+        """Add counts to Redis and reset, at most every interval seconds."""
+        now = time.monotonic()
+        if now - self.last_flush < interval:
+            return
+        with self.lock:
+            values, self.values = self.values, Counter()
+            self.last_flush = now
+        if not values:
+            return
+        pipe = redis_client.pipeline(transaction=False)
+        for key, value in values.items():
+            pipe.hincrbyfloat(REDIS_KEY, key, value)
+        pipe.execute()
+
+
+registry = MetricsRegistry()
+
+
+def cache_namespace(key):
+    # lib-1-collections, lib-1-items-20-0, item-5-detail, item-5-page
+    if key.startswith('lib-'):
+        return key.split('-', 3)[2]
+    if key.startswith('item-'):
+        return 'detail'
+    return 'other'
+
+
+def sort_key(field):
+    # group by metric name and labels, buckets in increasing le
+    name, _, rest = field.partition('{')
+    base = name
+    for suffix in ('_bucket', '_sum', '_count'):
+        if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+            base = name[:-len(suffix)]
+    le = 0
+    if 'le="' in rest:
+        rest, _, x = rest.rpartition('le="')
+        le = float(x.rstrip('"}').replace('+Inf', 'inf'))
+    return (base, rest, name, le)
+
+
+def render_metrics(redis_client):
+    """Prometheus text exposition of the aggregated metrics."""
+    fields = {k.decode('utf-8'): float(v) for k, v in redis_client.hgetall(REDIS_KEY).items()}
+    lines = []
+    typed = set()
+    for field in sorted(fields, key=sort_key):
+        base = sort_key(field)[0]
+        if base in METRICS and base not in typed:
+            typed.add(base)
+            lines.append(f'# HELP {base} {METRICS[base][1]}')
+            lines.append(f'# TYPE {base} {METRICS[base][0]}')
+        value = fields[field]
+        lines.append(f'{field} {int(value) if value.is_integer() else value}')
+    return '\n'.join(lines) + '\n'
+
+
+def init_metrics(app, redis_client):
+    """Record per endpoint latency, size, status and db time of every request."""
+    listen_engines()
+    interval = app.config.get('METRICS_FLUSH_INTERVAL', 5)
+    token = app.config.get('METRICS_TOKEN')
+
+    @app.before_request
+    def start_metrics():
+        start_request_stats()
+
+    @app.after_request
+    def record_metrics(response):
+        if 'request_start_time' not in g or request.endpoint == 'metrics':
+            return response
+
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        labels = {'endpoint': endpoint}
+        registry.observe('http_request_duration_seconds', labels, time.perf_counter() - g.request_start_time)
+        if response.content_length is not None: # not for streamed responses
+            registry.observe('http_response_size_bytes', labels, response.content_length, SIZE_BUCKETS)
+        registry.inc('http_requests_total', {'endpoint': endpoint, 'status': response.status_code})
+        if stats := g.get('sql_stats'):
+            registry.observe('db_duration_seconds', labels, stats.duration)
+            registry.inc('db_queries_total', labels, stats.count)
+
+        registry.flush(redis_client, interval)
+        return response
+
+    @app.route('/metrics', endpoint='metrics')
+    def metrics():
+        if not token or request.headers.get('Authorization') != f'Bearer {token}':
+            return abort(403)
+        registry.flush(redis_client)
+        return Response(render_metrics(redis_client), mimetype='text/plain; version=0.0.4')
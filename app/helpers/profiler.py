@@ -0,0 +1,213 @@
+import time
+import json
+import logging
+import threading
+from datetime import datetime
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import (
+    g,
+    request,
+    has_app_context,
+    has_request_context,
+    abort,
+    jsonify,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger('myapp')
+
+
+class SqlStats(object):
+    """Queries of one request: count, total db time, repeated statement shapes, slowest."""
+
+    def __init__(self, num_slowest=5):
+        self.count = 0
+        self.duration = 0.0 # seconds
+        self.shapes = Counter() # statement (parameters are bound, so same text = same shape): count
+        self.slowest = [] # [(duration, statement)]
+        self.num_slowest = num_slowest
+
+    def add(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.shapes[statement] += 1
+        if len(self.slowest) < self.num_slowest or duration > self.slowest[-1][0]:
+            self.slowest.append((duration, statement))
+            self.slowest.sort(key=lambda x: x[0], reverse=True)
+            del self.slowest[self.num_slowest:]
+
+
+class SlowQueryLog(object):
+    """Statements slower than threshold, with an EXPLAIN plan, in a Redis list ring buffer.
+
+    EXPLAIN runs on one background thread with its own connection, after the
+    slow query returned; (ANALYZE, BUFFERS) only for SELECT, since ANALYZE
+    executes the statement. The same statement is explained at most once
+    per `interval` seconds.
+    """
+    REDIS_KEY = 'slow-queries'
+
+    def __init__(self, redis_client, threshold_ms, size=200, interval=60, max_pending=20):
+        self.redis = redis_client
+        self.threshold = threshold_ms / 1000
+        self.size = size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.pending = 0
+        self.last_explained = {} # statement: time
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='explain')
+
+    def is_explaining(self):
+        return getattr(self.local, 'explaining', False)
+
+    def capture(self, conn, statement, parameters, duration, executemany):
+        now = time.monotonic()
+        with self.lock:
+            if self.pending >= self.max_pending:
+                return
+            if now - self.last_explained.get(statement, -self.interval) < self.interval:
+                return
+            if len(self.last_explained) >= self.size:
+                # statement texts vary (IN lists), forget the ones out of interval
+                self.last_explained = {k: v for k, v in self.last_explained.items() if now - v < self.interval}
+            self.last_explained[statement] = now
+            self.pending += 1
+
+        record = {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'duration_ms': round(duration * 1000, 2),
+            'statement': statement,
+            'parameters': parameters,
+            'path': request.path if has_request_context() else None,
+        }
+        explain_params = None if executemany else parameters
+        self.executor.submit(self.explain, conn.engine, record, explain_params, executemany)
+
+    def explain(self, engine, record, parameters, executemany):
+        self.local.explaining = True
+        try:
+            if executemany:
+                record['plan'] = None
+            else:
+                analyze = record['statement'].lstrip().upper().startswith(('SELECT', 'WITH'))
+                options = '(ANALYZE, BUFFERS) ' if analyze else ''
+                with engine.connect() as conn:
+                    rows = conn.exec_driver_sql(f'EXPLAIN {options}{record["statement"]}', parameters)
+                    record['plan'] = '\n'.join(x[0] for x in rows)
+                    conn.rollback()
+        except Exception as e:
+            record['plan'] = f'EXPLAIN failed: {e}'
+        finally:
+            self.local.explaining = False
+            with self.lock:
+                self.pending -= 1
+
+        try:
+            value = json.dumps(record, default=str, ensure_ascii=False)
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.lpush(self.REDIS_KEY, value)
+            pipe.ltrim(self.REDIS_KEY, 0, self.size - 1)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f'slow query log: {e}')
+        logger.warning(f'slow query {record["duration_ms"]}ms {record["path"] or ""}: {" ".join(record["statement"].split())[:300]}')
+
+
+slow_query_log = None
+
+
+def get_slow_queries(redis_client, limit=50):
+    return [json.loads(x) for x in redis_client.lrange(SlowQueryLog.REDIS_KEY, 0, limit - 1)]
+
+
+def get_sql_stats():
+    """SqlStats of the current request, None: not profiling or outside a request."""
+    if has_app_context():
+        return g.get('sql_stats')
+    return None
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info['query_start_time'].pop()
+    if stats := get_sql_stats():
+        stats.add(statement, duration)
+    if slow_query_log and duration >= slow_query_log.threshold and not slow_query_log.is_explaining():
+        slow_query_log.capture(conn, statement, parameters, duration, executemany)
+
+
+def listen_engines():
+    # on the Engine class: primary and replicas
+    if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+
+def start_request_stats(num_slowest=5):
+    """Start collecting SqlStats for this request (profiler and metrics share it)."""
+    if 'sql_stats' not in g:
+        g.request_start_time = time.perf_counter()
+        g.sql_stats = SqlStats(num_slowest)
+
+
+def init_slow_query_log(app, redis_client):
+    """Capture statements over SLOW_QUERY_MS with their plan (see SlowQueryLog),
+    viewed at /slow_queries (SLOW_QUERY_TOKEN) or `flask slowqueries`."""
+    global slow_query_log
+    listen_engines()
+    if slow_query_log is None:
+        slow_query_log = SlowQueryLog(
+            redis_client,
+            app.config['SLOW_QUERY_MS'],
+            size=app.config.get('SLOW_QUERY_LOG_SIZE', 200),
+        )
+
+    @app.route('/slow_queries')
+    def slow_queries():
+        token = app.config.get('SLOW_QUERY_TOKEN')
+        if not token or request.headers.get('Authorization') != f'Bearer {token}':
+            return abort(403)
+        return jsonify(get_slow_queries(redis_client, request.args.get('limit', 50, type=int)))
+
+
+def init_sql_profiler(app):
+    """Count and time the queries of every request (opt-in: SQL_PROFILE).
+
+    Adds Server-Timing headers (db, app) and a debug log line per request, and
+    warns when one statement runs more than SQL_PROFILE_REPEAT_WARN times (N+1).
+    """
+    listen_engines()
+
+    repeat_warn = app.config.get('SQL_PROFILE_REPEAT_WARN', 10)
+    num_slowest = app.config.get('SQL_PROFILE_SLOWEST', 5)
+
+    @app.before_request
+    def start_sql_stats():
+        start_request_stats(num_slowest)
+
+    @app.after_request
+    def report_sql_stats(response):
+        if not (stats := g.get('sql_stats')):
+            return response
+
+        total = (time.perf_counter() - g.request_start_time) * 1000
+        db = stats.duration * 1000
+        response.headers.add('Server-Timing', f'db;dur={db:.2f};desc="{stats.count} queries"')
+        response.headers.add('Server-Timing', f'app;dur={total:.2f}')
+
+        logger.debug(f'{request.method} {request.path} queries={stats.count} db={db:.2f}ms total={total:.2f}ms')
+        for duration, statement in stats.slowest:
+            logger.debug(f'  {duration * 1000:.2f}ms {" ".join(statement.split())[:300]}')
+        for statement, count in stats.shapes.items():
+            if count > repeat_warn:
+                logger.warning(f'{request.method} {request.path} same statement {count} times (N+1?): {" ".join(statement.split())[:300]}')
+
+        return response
@@ -0,0 +1,152 @@
+"""Item search document: names, other names and chosen field values as one tsvector.
+
+Tokens are built here, not by a Postgres text search config: words of
+latin text, and characters + character bigrams of CJK runs (no word
+boundaries to split on). Item.search_doc is GIN indexed; a query is the AND
+of its tokens, latin words as prefixes.
+
+Library ini, what goes into the document besides name and name_zh:
+
+    [search]
+    source_data = Chinese_name_other,synonyms
+    fields = common_name
+"""
+import re
+
+from sqlalchemy import (
+    select,
+    update,
+    bindparam,
+    cast,
+)
+from sqlalchemy.dialects.postgresql import TSVECTOR, TSQUERY
+
+from app.models import (
+    Item,
+    ItemData,
+    Field,
+)
+from app.database import session
+from app.helpers.library import get_config
+
+DEFAULT_SOURCE_DATA_KEYS = ('Chinese_name_other',)
+CHUNK_SIZE = 1000
+MAX_LEXEME_BYTES = 2046 # postgres tsvector/tsquery limit, longer ones fail the statement
+
+# kana, CJK ideographs (+ extension A, compatibility), hangul
+TOKEN_PATTERN = re.compile(r'([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]+)|(\w+)')
+
+
+def tokenize(text):
+    """[(token, is_cjk)], CJK runs as characters and bigrams."""
+    tokens = []
+    for cjk, word in TOKEN_PATTERN.findall((text or '').lower()):
+        if cjk:
+            tokens.extend((c, True) for c in cjk)
+            tokens.extend((cjk[i:i + 2], True) for i in range(len(cjk) - 1))
+        else:
+            tokens.append((word, False))
+    return tokens
+
+
+def quote(token):
+    # tsvector/tsquery literal
+    return "'" + token.replace('\\', '\\\\').replace("'", "''") + "'"
+
+
+def is_indexable(token):
+    return len(token.encode('utf-8')) <= MAX_LEXEME_BYTES
+
+
+def make_search_doc(texts):
+    """tsvector literal of the texts."""
+    tokens = {token for text in texts for token, _ in tokenize(text) if is_indexable(token)}
+    return ' '.join(quote(x) for x in sorted(tokens))
+
+
+def make_item_search_doc(item, source_data_keys, values):
+    """Document of an item row (name, name_zh, source_data), values: its chosen field values."""
+    source_data = item.source_data or {}
+    texts = [item.name, item.name_zh] + [str(source_data[k]) for k in source_data_keys if source_data.get(k)] + values
+    return make_search_doc(texts)
+
+
+def make_search_query(q):
+    """tsquery literal, None: nothing to search."""
+    terms = []
+    for cjk, word in TOKEN_PATTERN.findall(q.lower()):
+        if not is_indexable(cjk or word):
+            return None # never indexed, nothing matches
+        if cjk:
+            # the bigrams of a run (a single character is indexed too)
+            terms.extend(quote(cjk[i:i + 2]) for i in range(max(len(cjk) - 1, 1)))
+        else:
+            terms.append(f'{quote(word)}:*')
+    return ' & '.join(dict.fromkeys(terms)) or None
+
+
+def make_search_condition(q):
+    if query := make_search_query(q):
+        return Item.search_doc.op('@@')(cast(query, TSQUERY))
+    return Item.id.is_(None) # only punctuation: no match
+
+
+def search_config(config):
+    source_data_keys = DEFAULT_SOURCE_DATA_KEYS
+    field_names = ()
+    if config and config.has_section('search'):
+        if x := config.get('search', 'source_data', fallback=None):
+            source_data_keys = tuple(k.strip() for k in x.split(',') if k.strip())
+        if x := config.get('search', 'fields', fallback=None):
+            field_names = tuple(k.strip() for k in x.split(',') if k.strip())
+    return source_data_keys, field_names
+
+
+def update_search_docs(library_id, chunk_size=CHUNK_SIZE):
+    """(Re)build Item.search_doc of a library, run after import."""
+    source_data_keys, field_names = search_config(get_config(library_id))
+
+    stmt = (
+        select(
+            Item.id,
+            Item.name,
+            Item.name_zh,
+            Item.source_data,
+        )
+        .where(Item.library_id == library_id)
+        .order_by(Item.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    stmt_u = (
+        update(Item)
+        .where(Item.id == bindparam('item_id'))
+        .values(search_doc=cast(bindparam('doc'), TSVECTOR))
+    )
+    count = 0
+    for items in session.execute(stmt).partitions():
+        values = {}
+        if field_names:
+            for item_id, value in session.execute(
+                select(
+                    ItemData.item_id,
+                    ItemData.value,
+                )
+                .join(
+                    Field,
+                    Field.id == ItemData.field_id,
+                )
+                .where(
+                    ItemData.item_id.in_([x.id for x in items]),
+                    Field.name.in_(field_names),
+                )
+            ):
+                values.setdefault(item_id, []).append(value)
+
+        docs = [
+            {'item_id': x.id, 'doc': make_item_search_doc(x, source_data_keys, values.get(x.id, []))}
+            for x in items
+        ]
+        session.connection().execute(stmt_u, docs)
+        count += len(items)
+    session.commit()
+    return count
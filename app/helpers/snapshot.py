@@ -0,0 +1,143 @@
+"""Static snapshot of a library for nginx/CDN: index, item pages and listing JSON.
+
+Layout under {output}/{library.name}/ (URL paths, see README for nginx):
+
+    index.html
+    items/{id}.html
+    api/library/{id}/collections.json
+    api/library/{id}/items-{limit}-{offset}.json
+    static/...
+    manifest.json       {'data_version', 'items': {id: version}}
+
+Item pages are rebuilt only when their version (version + updated_at) differs
+from the manifest, JSON and index when the library data_version changed.
+"""
+import os
+import json
+import shutil
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import render_template
+from sqlalchemy import select
+
+from app.database import session, dispose_engines
+from app.models import Library, Item
+from app.helpers.collection import get_collections
+from app.helpers.item import (
+    make_item_rows_stmt,
+    get_facet_keys,
+    get_facet_counts,
+    make_items_data,
+)
+
+PAGE_SIZE = 20 # script.js grid limit
+CHUNK_SIZE = 200 # item pages per task
+
+
+def write_file(path, content):
+    # atomic, nginx never serves a half written file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'.{path.name}.tmp')
+    if isinstance(content, bytes):
+        tmp_path.write_bytes(content)
+    else:
+        tmp_path.write_text(content, encoding='utf-8')
+    os.replace(tmp_path, path)
+
+
+def item_version(row):
+    # version is bumped by sync, updated_at by any ORM update
+    return f'{row.version}-{row.updated_at.isoformat() if row.updated_at else ""}'
+
+
+def init_worker():
+    dispose_engines()
+
+
+def render_item_pages(root, host, item_ids):
+    """Process pool task, uses the forked flask_app."""
+    from app import flask_app
+    from app.blueprints.frontpage import render_item_detail
+
+    count = 0
+    with flask_app.app_context():
+        try:
+            for item_id in item_ids:
+                with flask_app.test_request_context(f'/items/{item_id}', headers={'Host': host}):
+                    if page := render_item_detail(item_id):
+                        write_file(Path(root, 'items', f'{item_id}.html'), page['html'])
+                        count += 1
+        finally:
+            session.remove()
+    return count
+
+
+def build_json(app, root, library_id):
+    api_dir = Path(root, 'api', 'library', str(library_id))
+    write_file(api_dir / 'collections.json', app.json.dumps_bytes(get_collections(library_id, 2)))
+
+    # all pages from one query, instead of growing offsets
+    rows = session.execute(make_item_rows_stmt(library_id, {})).all()
+    total = len(rows)
+    facets = None
+    if keys := get_facet_keys(library_id):
+        facets = get_facet_counts(library_id, {}, keys)
+    offsets = range(0, max(total, 1), PAGE_SIZE)
+    for offset in offsets:
+        data = make_items_data(rows[offset:offset + PAGE_SIZE], total, facets)
+        write_file(api_dir / f'items-{PAGE_SIZE}-{offset}.json', app.json.dumps_bytes(data))
+
+    # pages past the new total (the library shrank)
+    for x in api_dir.glob(f'items-{PAGE_SIZE}-*.json'):
+        if (offset := x.stem.rsplit('-', 1)[-1]).isdigit() and int(offset) not in offsets:
+            x.unlink(missing_ok=True)
+    return len(offsets)
+
+
+def build_static(app, library_id, output, workers=4, full=False):
+    """Render a library into output, only what changed since the last build.
+
+    Returns: {'pages', 'deleted', 'json_pages'}
+    """
+    with app.app_context():
+        library = session.get(Library, library_id)
+        root = Path(output, library.name)
+        manifest_path = root / 'manifest.json'
+        manifest = {}
+        if manifest_path.exists() and not full:
+            manifest = json.loads(manifest_path.read_text(encoding='utf-8'))
+        built = manifest.get('items', {})
+
+        versions = {
+            str(x.id): item_version(x) for x in session.execute(
+                select(
+                    Item.id,
+                    Item.version,
+                    Item.updated_at,
+                )
+                .where(Item.library_id == library_id)
+            )
+        }
+        changed = [int(x) for x, version in versions.items() if built.get(x) != version]
+        deleted = [x for x in built if x not in versions]
+
+        result = {'pages': 0, 'deleted': len(deleted), 'json_pages': 0}
+        if full or manifest.get('data_version') != library.data_version:
+            with app.test_request_context('/', headers={'Host': library.host or ''}):
+                write_file(root / 'index.html', render_template('index.html', library=library))
+            result['json_pages'] = build_json(app, root, library_id)
+            shutil.copytree(app.static_folder, root / 'static', dirs_exist_ok=True)
+        host = library.host or ''
+        data_version = library.data_version
+        session.remove()
+
+    # forked workers: connections must not be shared with this process
+    chunks = [changed[i:i + CHUNK_SIZE] for i in range(0, len(changed), CHUNK_SIZE)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        result['pages'] = sum(executor.map(render_item_pages, [root] * len(chunks), [host] * len(chunks), chunks))
+
+    for x in deleted:
+        Path(root, 'items', f'{x}.html').unlink(missing_ok=True)
+    write_file(manifest_path, json.dumps({'data_version': data_version, 'items': versions}))
+    return result
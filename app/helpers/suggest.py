@@ -0,0 +1,153 @@
+"""Typeahead: per library sorted prefix index over item names, in process memory.
+
+Terms are name, name_zh and source_data Chinese_name_other, lowercased, plus
+every word of them after the first (so "fus" finds "Ficus fusca"). A lookup
+is a bisect into the sorted terms and a walk while they share the prefix.
+Indexes are built at worker start (gunicorn post_fork) or on first use. Every
+VERSION_CHECK_INTERVAL seconds a background thread checks the library
+data_version and rebuilds on change; requests keep the old index meanwhile.
+"""
+import time
+import bisect
+import threading
+
+from sqlalchemy import select
+
+from app.database import session
+from app.models import Library, Item
+from app.helpers.item import make_items_stmt
+
+VERSION_CHECK_INTERVAL = 30 # seconds
+MAX_SUGGESTIONS = 20
+
+
+class PrefixIndex(object):
+
+    def __init__(self, rows):
+        """rows: (id, name, name_zh, name_zh_other)"""
+        entries = []
+        self.items = {}
+        for row in rows:
+            self.items[row.id] = (row.name, row.name_zh)
+            for text in (row.name, row.name_zh, row.name_zh_other):
+                if not text:
+                    continue
+                term = text.lower()
+                entries.append((term, row.id, text))
+                for i, c in enumerate(term):
+                    if c == ' ' and term[i + 1:i + 2].strip():
+                        entries.append((term[i + 1:], row.id, text))
+        entries.sort()
+        self.terms = [x[0] for x in entries]
+        self.entries = [(x[1], x[2]) for x in entries]
+
+    def search(self, q, limit=10):
+        q = q.lower().strip()
+        results = []
+        if not q:
+            return results
+        seen = set()
+        i = bisect.bisect_left(self.terms, q)
+        while i < len(self.terms) and len(results) < limit and self.terms[i].startswith(q):
+            item_id, text = self.entries[i]
+            if item_id not in seen:
+                seen.add(item_id)
+                name, name_zh = self.items[item_id]
+                results.append({
+                    'id': item_id,
+                    'name': name,
+                    'name_zh': name_zh,
+                    'text': text,
+                })
+            i += 1
+        return results
+
+
+indexes = {} # library_id: {'version', 'index', 'checked_at'}
+locks = {} # library_id: Lock, one build per library and process
+library_ids = {'ids': frozenset(), 'checked_at': float('-inf')}
+
+
+def build_index(library_id):
+    stmt = make_items_stmt(
+        library_id,
+        {},
+        Item.id,
+        Item.name,
+        Item.name_zh,
+        Item.source_data['Chinese_name_other'].astext.label('name_zh_other'),
+    ).distinct()
+    return PrefixIndex(session.execute(stmt))
+
+
+def get_data_version(library_id):
+    return session.execute(select(Library.data_version).where(Library.id == library_id)).scalar()
+
+
+def library_exists(library_id):
+    """Unknown ids reload the library ids at most every VERSION_CHECK_INTERVAL
+    seconds, so any id in a url costs neither a query nor a lock."""
+    now = time.monotonic()
+    if library_id not in library_ids['ids'] and now - library_ids['checked_at'] >= VERSION_CHECK_INTERVAL:
+        library_ids.update(ids=frozenset(session.execute(select(Library.id)).scalars()), checked_at=now)
+    return library_id in library_ids['ids']
+
+
+def refresh_index(library_id, x):
+    """Rebuild x (None: first build) if the data version changed, holding the library lock."""
+    if (version := get_data_version(library_id)) is None:
+        indexes.pop(library_id, None)
+        return None
+    if not x or x['version'] != version:
+        x = {'version': version, 'index': build_index(library_id)}
+    indexes[library_id] = {**x, 'checked_at': time.monotonic()}
+    return x['index']
+
+
+def refresh_in_background(library_id, x, lock):
+    try:
+        refresh_index(library_id, x)
+    finally:
+        session.remove()
+        lock.release()
+
+
+def get_index(library_id):
+    """Index of the library, None: no such library.
+
+    Only the first build blocks (requests of that library); later checks and
+    rebuilds run in a thread while the current index is served.
+    """
+    x = indexes.get(library_id)
+    if x and time.monotonic() - x['checked_at'] < VERSION_CHECK_INTERVAL:
+        return x['index']
+    if not x and not library_exists(library_id):
+        return None
+
+    lock = locks.setdefault(library_id, threading.Lock())
+    if x:
+        if lock.acquire(blocking=False): # else a refresh is running
+            threading.Thread(target=refresh_in_background, args=(library_id, x, lock), daemon=True).start()
+        return x['index']
+
+    with lock:
+        if x := indexes.get(library_id):
+            return x['index']
+        return refresh_index(library_id, None)
+
+
+def suggest(library_id, q, limit=10):
+    if index := get_index(library_id):
+        return index.search(q, min(limit, MAX_SUGGESTIONS))
+    return None
+
+
+def warm_suggest_indexes(app):
+    """Build the indexes of all libraries in this process."""
+    with app.app_context():
+        try:
+            for library_id in session.execute(select(Library.id)).scalars().all():
+                get_index(library_id)
+        finally:
+            session.remove()
+    return len(indexes)
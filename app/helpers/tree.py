@@ -0,0 +1,214 @@
+"""Collection tree edits: insert node, move subtree, delete subtree, move items.
+
+Every edit is a few set-based statements on collection_closure,
+collection.path and collection_item in one transaction, then the library
+data_version is bumped and its cached trees and the affected item pages
+are dropped (counts are computed from collection_item, nothing to update).
+"""
+from contextlib import contextmanager
+
+from sqlalchemy import (
+    select,
+    insert,
+    update,
+    delete,
+    func,
+    literal,
+)
+from sqlalchemy.orm import aliased
+
+from app.models import (
+    Library,
+    Item,
+    Collection,
+    CollectionItem,
+    CollectionClosure,
+)
+from app.database import session
+from app.helpers.cache import delete_cache, delete_item_caches
+from app.helpers.item import make_subtree_condition, bump_item_versions
+
+
+@contextmanager
+def edit_tree(library_id):
+    """One transaction, bump data_version in it, drop caches after commit.
+
+    Yields a set, add the ids of items whose pages changed (their version is
+    bumped in the same transaction).
+    """
+    item_ids = set()
+    try:
+        yield item_ids
+        bump_item_versions(item_ids)
+        session.execute(
+            update(Library)
+            .where(Library.id == library_id)
+            .values(data_version=Library.data_version + 1)
+        )
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+    delete_cache(f'lib-{library_id}-*')
+    delete_item_caches(item_ids)
+
+
+def get_subtree_item_ids(collection_id):
+    stmt = (
+        select(
+            CollectionItem.item_id,
+        )
+        .join(
+            Collection,
+            Collection.id == CollectionItem.collection_id,
+        )
+        .where(make_subtree_condition(collection_id))
+    )
+    return session.execute(stmt).scalars().all()
+
+
+def insert_collection(parent_id, name, level, name_zh=None, library_id=None, key=None):
+    """New collection under parent_id (None: a root of library_id)."""
+    parent = session.get(Collection, parent_id) if parent_id else None
+    if parent_id and not parent:
+        raise ValueError(f'collection {parent_id} not found')
+
+    library_id = parent.library_id if parent else library_id
+    with edit_tree(library_id):
+        values = {'name': name, 'name_zh': name_zh, 'level': level, 'library_id': library_id}
+        if key:
+            values['key'] = key
+        collection = Collection(**values)
+        session.add(collection)
+        session.flush()
+
+        # parent's ancestors + itself
+        if parent:
+            session.execute(
+                insert(CollectionClosure).from_select(
+                    ['ancestor_id', 'descendant_id', 'depth'],
+                    select(
+                        CollectionClosure.ancestor_id,
+                        literal(collection.id),
+                        CollectionClosure.depth + 1,
+                    )
+                    .where(CollectionClosure.descendant_id == parent.id)
+                )
+            )
+        session.add(CollectionClosure(ancestor_id=collection.id, descendant_id=collection.id, depth=0))
+        collection.path = f'{parent.path if parent else "/"}{collection.id}/'
+    return collection
+
+
+def move_subtree(collection_id, new_parent_id):
+    """Move a collection (and everything under it) below new_parent_id."""
+    collection = session.get(Collection, collection_id)
+    new_parent = session.get(Collection, new_parent_id)
+    if not collection or not new_parent:
+        raise ValueError('collection not found')
+    if new_parent.library_id != collection.library_id:
+        raise ValueError('can not move to another library')
+    if session.get(CollectionClosure, (collection_id, new_parent_id)):
+        raise ValueError('can not move under itself')
+
+    old_prefix = collection.path[:collection.path.rstrip('/').rfind('/') + 1] # parent's path
+    subtree = select(CollectionClosure.descendant_id).where(CollectionClosure.ancestor_id == collection_id)
+    with edit_tree(collection.library_id) as item_ids:
+        item_ids.update(get_subtree_item_ids(collection_id))
+
+        # drop links from the old ancestors into the subtree
+        session.execute(
+            delete(CollectionClosure)
+            .where(
+                CollectionClosure.descendant_id.in_(subtree),
+                CollectionClosure.ancestor_id.in_(
+                    select(CollectionClosure.ancestor_id)
+                    .where(
+                        CollectionClosure.descendant_id == collection_id,
+                        CollectionClosure.depth > 0,
+                    )
+                ),
+            )
+        )
+        # every ancestor of the new parent x every node of the subtree
+        sup = aliased(CollectionClosure)
+        sub = aliased(CollectionClosure)
+        session.execute(
+            insert(CollectionClosure).from_select(
+                ['ancestor_id', 'descendant_id', 'depth'],
+                select(
+                    sup.ancestor_id,
+                    sub.descendant_id,
+                    sup.depth + sub.depth + 1,
+                )
+                .join(
+                    sub,
+                    sub.ancestor_id == collection_id,
+                )
+                .where(sup.descendant_id == new_parent_id)
+            )
+        )
+        # rewrite the path prefix of the subtree
+        session.execute(
+            update(Collection)
+            .where(make_subtree_condition(collection_id))
+            .values(path=new_parent.path + func.substr(Collection.path, len(old_prefix) + 1))
+            .execution_options(synchronize_session=False)
+        )
+    session.expire_all()
+    return collection
+
+
+def delete_subtree(collection_id):
+    """Delete a collection and everything under it, items are only unlinked.
+
+    Returns: (deleted collections, unlinked item ids)
+    """
+    if not (collection := session.get(Collection, collection_id)):
+        raise ValueError(f'collection {collection_id} not found')
+
+    with edit_tree(collection.library_id) as item_ids:
+        collection_ids = session.execute(
+            select(CollectionClosure.descendant_id).where(CollectionClosure.ancestor_id == collection_id)
+        ).scalars().all()
+        item_ids.update(get_subtree_item_ids(collection_id))
+
+        session.execute(delete(CollectionItem).where(CollectionItem.collection_id.in_(collection_ids)))
+        session.execute(delete(CollectionClosure).where(CollectionClosure.descendant_id.in_(collection_ids)))
+        session.execute(
+            delete(Collection)
+            .where(Collection.id.in_(collection_ids))
+            .execution_options(synchronize_session=False)
+        )
+    session.expire_all()
+    return len(collection_ids), sorted(item_ids)
+
+
+def move_items(item_ids, collection_id):
+    """Put items into collection_id, replacing their current collection."""
+    if not (collection := session.get(Collection, collection_id)):
+        raise ValueError(f'collection {collection_id} not found')
+    found = session.execute(
+        select(Item.id).where(Item.id.in_(item_ids), Item.library_id == collection.library_id)
+    ).scalars().all()
+    if others := set(item_ids) - set(found):
+        raise ValueError(f'items not in library {collection.library_id}: {sorted(others)}')
+
+    with edit_tree(collection.library_id) as changed:
+        changed.update(item_ids)
+        session.execute(
+            update(CollectionItem)
+            .where(CollectionItem.item_id.in_(item_ids))
+            .values(collection_id=collection_id)
+            .execution_options(synchronize_session=False)
+        )
+        linked = session.execute(
+            select(CollectionItem.item_id).where(CollectionItem.item_id.in_(item_ids))
+        ).scalars().all()
+        if missing := set(item_ids) - set(linked):
+            session.execute(
+                insert(CollectionItem),
+                [{'item_id': x, 'collection_id': collection_id, 'library_id': collection.library_id} for x in missing],
+            )
+    return len(item_ids)
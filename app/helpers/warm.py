@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import select
+
+from app.database import session
+from app.models import Library, Item
+from app.helpers.cache import (
+    set_cache,
+    delete_cache,
+    delete_item_caches,
+    lock_cache,
+    get_top_ranks,
+)
+from app.helpers.compress import make_payload, make_json_payload
+from app.helpers.collection import get_collections
+from app.helpers.item import (
+    get_items_data,
+    get_item_details,
+    make_items_cache_key,
+)
+
+CACHE_EXPIRE = 86400 # 1 day: 60 * 60 * 24, same as the views
+PAGE_SIZE = 20 # script.js grid limit
+
+
+def warm_collections(library_id):
+    set_cache(f'lib-{library_id}-collections', make_json_payload(get_collections(library_id, 2)), CACHE_EXPIRE)
+    return 1
+
+
+def warm_items(library_id, num_pages):
+    for page in range(num_pages):
+        offset = page * PAGE_SIZE
+        data = get_items_data(library_id, {}, PAGE_SIZE, offset)
+        set_cache(make_items_cache_key(library_id, {}, PAGE_SIZE, offset), make_json_payload(data), CACHE_EXPIRE)
+        if offset + PAGE_SIZE >= data['total']:
+            return page + 1
+    return num_pages
+
+
+def warm_searches(library_id, num_searches):
+    queries = get_top_ranks(f'rank-lib-{library_id}-searches', num_searches)
+    for q in queries:
+        filtr = {'q': q}
+        if cache_key := make_items_cache_key(library_id, filtr, PAGE_SIZE, 0, top_query=True):
+            set_cache(cache_key, make_json_payload(get_items_data(library_id, filtr, PAGE_SIZE, 0)), CACHE_EXPIRE)
+    return len(queries)
+
+
+def warm_item_details(app, library, num_items):
+    from app.blueprints.frontpage import render_item_detail
+
+    item_ids = [int(x) for x in get_top_ranks(f'rank-lib-{library.id}-items', num_items)]
+    # json: set-based, all items at once
+    for detail in get_item_details(item_ids):
+        set_cache(f'item-{detail["id"]}-detail', make_json_payload(detail, library_id=detail['library_id']), CACHE_EXPIRE)
+
+    # html: the page needs a request on the library host (context processor)
+    if library.host:
+        for item_id in item_ids:
+            with app.test_request_context(f'/items/{item_id}', headers={'Host': library.host}):
+                if page := render_item_detail(item_id):
+                    set_cache(f'item-{item_id}-page', make_payload(page['html'], library_id=page['library_id']), CACHE_EXPIRE)
+    return len(item_ids)
+
+
+def warm_cache(app, library_ids=None, num_pages=5, num_searches=20, num_items=100, workers=4, clear=False):
+    """Precompute the cached views of libraries (default all), run at deploy and after imports.
+
+    Tasks (collection tree, first item pages, top searches, top item details) of
+    all libraries run in a pool of `workers` threads, each with its own session.
+
+    Returns: [(library_id, task, count or error)]
+    """
+    with app.app_context():
+        stmt = Library.query
+        if library_ids:
+            stmt = stmt.filter(Library.id.in_(library_ids))
+        libraries = stmt.all()
+        item_ids = []
+        if clear:
+            item_ids = session.execute(
+                select(Item.id).where(Item.library_id.in_([x.id for x in libraries]))
+            ).scalars().all()
+        session.remove()
+
+    if clear:
+        for library in libraries:
+            delete_cache(f'lib-{library.id}-*')
+        # item pages and details (1 day) show the imported data too
+        delete_item_caches(item_ids)
+
+    def run(task):
+        library, name = task
+        with app.app_context():
+            try:
+                if name == 'collections':
+                    return library.id, name, warm_collections(library.id)
+                elif name == 'items':
+                    return library.id, name, warm_items(library.id, num_pages)
+                elif name == 'searches':
+                    return library.id, name, warm_searches(library.id, num_searches)
+                elif name == 'details':
+                    return library.id, name, warm_item_details(app, library, num_items)
+            except Exception as e:
+                session.rollback()
+                return library.id, name, e
+            finally:
+                session.remove()
+
+    tasks = [(library, name) for library in libraries for name in ('collections', 'items', 'searches', 'details')]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run, tasks))
+
+
+def warm_cache_once(app, expire=600, **kwargs):
+    """warm_cache by only one process (gunicorn workers) within expire seconds."""
+    if lock_cache('warm-cache-lock', expire):
+        return warm_cache(app, **kwargs)
@@ -23,6 +23,9 @@ from sqlalchemy import (
     func,
     UUID,
     PrimaryKeyConstraint,
+    Index,
+    text,
+    true,
 )
 from sqlalchemy.orm import (
     relationship,
@@ -31,7 +34,7 @@ from sqlalchemy.orm import (
     Mapped,
     mapped_column,
 )
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 
 from app.database import (
     Base,
@@ -104,6 +107,10 @@ class Item(Base, TimestampMixin, SyncMixin):
     item_type_id: Mapped[int] = mapped_column(ForeignKey('item_type.id'))
     library_id: Mapped[int] = mapped_column(ForeignKey('library.id'))
     source_data: Mapped[Dict[str, Any]] = mapped_column(JSONB)
+    # names, other names, chosen field values (app.helpers.search), rebuilt on import
+    search_doc: Mapped[Optional[str]] = mapped_column(TSVECTOR, deferred=True)
+    # library [visibility] rule (app.helpers.item.update_visibility), rebuilt on import
+    is_visible: Mapped[bool] = mapped_column(Boolean, default=True, server_default=true())
 
     item_type: Mapped['ItemType'] = relationship('ItemType')
 
@@ -128,6 +135,15 @@ class Item(Base, TimestampMixin, SyncMixin):
     notes: Mapped[list['ItemNote']] = relationship('ItemNote')
     attachments: Mapped[list['ItemAttachment']] = relationship('ItemAttachment')
 
+    __table_args__ = (
+        # facet filters: source_data @> '{"key": "value"}'
+        Index('ix_item_source_data', 'source_data', postgresql_using='gin', postgresql_ops={'source_data': 'jsonb_path_ops'}),
+        Index('ix_item_search_doc', 'search_doc', postgresql_using='gin'),
+        Index('ix_item_library_name', 'library_id', 'name'),
+        # listing and counts only read visible items
+        Index('ix_item_visible_library_name', 'library_id', 'name', postgresql_where=text('is_visible')),
+    )
+
     @property
     def pretty_source_data(self):
         if x := self.source_data:
@@ -145,9 +161,11 @@ class Item(Base, TimestampMixin, SyncMixin):
         from app.helpers.library import get_config
         data = []
         field_values = {}
+        field_htmls = {}
 
         for x in self.data_values:
             field_values[x.field_id] = x.value
+            field_htmls[x.field_id] = x.value_html
 
         config = get_config(self.library_id)
 
@@ -158,8 +176,10 @@ class Item(Base, TimestampMixin, SyncMixin):
             field = m.field
 
             value = ''
+            value_html = None
             if field.id in field_values:
                 value = field_values[field.id]
+                value_html = field_htmls[field.id]
 
             # overwrite by source_data
             if 'item_source_data_field' in config :
@@ -167,6 +187,7 @@ class Item(Base, TimestampMixin, SyncMixin):
                     if str(field_id) == str(field.id):
                         if x := self.source_data.get(key):
                             value = x
+                            value_html = None # not pre-rendered
                             break
 
             data.append({
@@ -174,6 +195,7 @@ class Item(Base, TimestampMixin, SyncMixin):
                 'name': field.name,
                 'label': field.label,
                 'value': value,
+                'value_html': value_html,
                 'control_id': m.control_id,
             })
 
@@ -186,6 +208,18 @@ class ItemData(Base):
     item_id: Mapped[int] = mapped_column(ForeignKey('item.id'))
     field_id: Mapped[int] = mapped_column(ForeignKey('field.id'))
     value: Mapped[str] = mapped_column(Text)
+    value_html: Mapped[Optional[str]] = mapped_column(Text) # pre-rendered BBCode, see render_item_html
+
+    __table_args__ = (
+        # no value column: long texts (BBCode) exceed the btree row size
+        Index('ix_item_data_item_field', 'item_id', 'field_id'),
+    )
+
+    @validates('value')
+    def validate_value(self, key, value):
+        if value != self.value:
+            self.value_html = None
+        return value
 
 
 class ItemNote(Base, SyncMixin):
@@ -196,6 +230,11 @@ class ItemNote(Base, SyncMixin):
     parent_id: Mapped[Optional[int]] = mapped_column(ForeignKey('item_note.id'))
     title: Mapped[str] = mapped_column(String(500))
     note: Mapped[str] = mapped_column(Text)
+    note_html: Mapped[Optional[str]] = mapped_column(Text) # pre-rendered BBCode, see render_item_html
+
+    __table_args__ = (
+        Index('ix_item_note_item_id', 'item_id'),
+    )
 
     # Self-referential relationship
     parent_item_note: Mapped[Optional['ItemNote']] = relationship(
@@ -208,6 +247,13 @@ class ItemNote(Base, SyncMixin):
         back_populates='parent_item_note'
     )
 
+    @validates('note')
+    def validate_note(self, key, value):
+        # edited text: drop stale html, template falls back to bbcode filter until re-rendered
+        if value != self.note:
+            self.note_html = None
+        return value
+
 
 class ItemAttachment(Base, SyncMixin):
     __tablename__ = 'item_attachment'
@@ -218,6 +264,12 @@ class ItemAttachment(Base, SyncMixin):
     mimetype: Mapped[str] = mapped_column(String(500))
     path: Mapped[str] = mapped_column(String(1000))
     source_data: Mapped[Dict[str, Any]] = mapped_column(JSONB)
+    # {size: {'path', 'width', 'height'}}, app.helpers.derivative
+    derivatives: Mapped[Optional[Dict[str, Any]]] = mapped_column(JSONB)
+
+    __table_args__ = (
+        Index('ix_item_attachment_item_id', 'item_id'),
+    )
 
 class Library(Base):
     __tablename__ = 'library'
@@ -226,6 +278,8 @@ class Library(Base):
     name: Mapped[str] = mapped_column(String(500))
     host: Mapped[Optional[str]] = mapped_column(String(500))
     title: Mapped[Optional[str]] = mapped_column(String(500))
+    # bumped on every data change (import), derived files/indexes are rebuilt on change
+    data_version: Mapped[int] = mapped_column(default=1, server_default='1')
 
 class Collection(Base, SyncMixin):
     __tablename__ = 'collection'
@@ -235,6 +289,13 @@ class Collection(Base, SyncMixin):
     name_zh: Mapped[Optional[str]] = mapped_column(String(500))
     library_id: Mapped[int] = mapped_column(ForeignKey('library.id'))
     level: Mapped[str] = mapped_column(String(500))
+    # materialized path of ancestor ids, root first, self last: '/12/57/301/'
+    # "C" collation: byte order, a subtree is the btree range [path, path + '~')
+    path: Mapped[Optional[str]] = mapped_column(String(500, collation='C'))
+
+    __table_args__ = (
+        Index('ix_collection_path', 'path'),
+    )
 
     # Relationships to traverse the hierarchy through the closure table
     # These are 'viewonly' because we will manage the closure table manually.
@@ -279,6 +340,11 @@ class CollectionItem(Base, SyncMixin):
     collection_id: Mapped[int] = mapped_column(ForeignKey('collection.id'))
     library_id: Mapped[int] = mapped_column(ForeignKey('library.id'))
 
+    __table_args__ = (
+        Index('ix_collection_item_collection_id', 'collection_id'),
+        Index('ix_collection_item_item_id', 'item_id'),
+    )
+
     # Bidirectional relationships with back_populates
     collection: Mapped['Collection'] = relationship(
         'Collection',
@@ -302,4 +368,6 @@ class CollectionClosure(Base):
 
     __table_args__ = (
         PrimaryKeyConstraint('ancestor_id', 'descendant_id', name='collection_closure_pk'),
+        # ancestors of a node (breadcrumbs, moves); the pk covers ancestor_id first
+        Index('ix_collection_closure_descendant_depth', 'descendant_id', 'depth'),
     )
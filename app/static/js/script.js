@@ -181,6 +181,30 @@ function initializeGrid(searchQuery = '', collectionId = null) {
   });
 }
 
+// Typeahead: fill the search datalist from the suggest endpoint
+let suggestTimeout;
+function updateSuggestions(searchValue) {
+  clearTimeout(suggestTimeout);
+  const datalist = document.getElementById('searchSuggestions');
+  if (!datalist || !searchValue.trim()) {
+    return;
+  }
+  suggestTimeout = setTimeout(() => {
+    fetch(`/api/library/${LIBRARY_ID}/suggest?q=${encodeURIComponent(searchValue)}`)
+      .then(response => response.json())
+      .then(data => {
+        datalist.innerHTML = '';
+        data.suggestions.forEach(x => {
+          const option = document.createElement('option');
+          option.value = x.text;
+          option.label = x.text === x.name ? (x.name_zh || '') : x.name;
+          datalist.appendChild(option);
+        });
+      })
+      .catch(error => console.error('Error loading suggestions:', error));
+  }, 150);
+}
+
 // Reload Grid with search query and/or collection filter
 function reloadGridWithSearch(searchQuery, collectionId = undefined) {
   if (gridInstance) {
@@ -343,6 +367,7 @@ function initializeEventListeners() {
             if (searchInputGallery) {
                 searchInputGallery.value = searchValue;
             }
+            updateSuggestions(searchValue);
 
             // Debounce search to avoid too many API calls
             clearTimeout(searchTimeout);
@@ -358,6 +383,7 @@ function initializeEventListeners() {
             if (searchInput) {
                 searchInput.value = searchValue;
             }
+            updateSuggestions(searchValue);
 
             // Debounce search to avoid too many API calls
             clearTimeout(searchTimeout);
@@ -0,0 +1 @@
+from app.async_api import async_app as app
@@ -0,0 +1,17 @@
+import os
+import threading
+
+
+def post_fork(server, worker):
+    # WARM_CACHE_ON_START=1: one worker (redis lock) warms the caches after a deploy,
+    # every worker builds its own typeahead indexes (app.helpers.suggest)
+    if os.getenv('WARM_CACHE_ON_START'):
+        def warm():
+            from app import flask_app
+            from app.helpers.warm import warm_cache_once
+            from app.helpers.suggest import warm_suggest_indexes
+            server.log.info(f'suggest indexes: {warm_suggest_indexes(flask_app)}')
+            if results := warm_cache_once(flask_app):
+                server.log.info(f'warm cache: {len(results)} tasks')
+
+        threading.Thread(target=warm, daemon=True).start()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Catalog Benchmark
+
+Seeds the database of the app config (use an empty local Postgres after
+`flask migrate`, not production) with a synthetic library, times the hot
+paths and writes the results as JSON, so runs of different commits can be
+compared.
+
+Synthetic library: ranks kingdom -> species, N items (one record each, like
+csv-to-hierarchy.py output), their ItemData, BBCode notes and closure rows,
+generated from a seed so every run gets the same catalog.
+
+Usage:
+    python scripts/benchmark.py
+    python scripts/benchmark.py --items 20000 --branching 6 -o bench-new.json
+    python scripts/benchmark.py --compare bench-old.json -o bench-new.json
+
+Benchmarks:
+    import_collection         import of the generated hierarchy (once)
+    get_collections           collection tree (to depth 2)
+    get_items                 first page
+    get_items_search          name search
+    get_items_collection      filter by a top-level collection
+    get_items_deep_offset     last page
+    item_field_data           Item.field_data
+    item_detail_render        item page html
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import itertools
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+from datetime import datetime
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import select, delete, insert
+
+from app import flask_app
+from app.database import session
+from app.models import (
+    Library,
+    ItemType,
+    ItemTypeField,
+    Field,
+    Item,
+    ItemData,
+    ItemNote,
+    Collection,
+    CollectionItem,
+    CollectionClosure,
+)
+from app.helpers.collection import import_collection, get_collections
+from app.helpers.item import get_items
+
+RANKS = ['kingdom', 'phylum', 'class', 'order', 'family', 'genus', 'species']
+
+BBCODE_SNIPPETS = [
+    '[B]{name}[/B] {name_zh}\n',
+    '[SIZE=4][COLOR=#336699]Description[/COLOR][/SIZE]\n',
+    '[I]{name}[/I] is found in [U]lowland forests[/U].\n',
+    '[URL="https://example.org/taxon/{n}"]reference {n}[/URL]\n',
+    '[attach]{n}[/attach]\n',
+    'Plain text line about habitat and distribution, repeated for length. ' * 3 + '\n',
+]
+
+
+def random_zh(rng, length):
+    return ''.join(chr(rng.randint(0x4E00, 0x9FA5)) for _ in range(length))
+
+
+def random_key(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def generate_hierarchy(num_items, branching, ranks, seed):
+    """Hierarchy dict in the import_collection format, num_items species records."""
+    rng = random.Random(seed)
+    counter = {'items': 0, 'nodes': 0}
+
+    def make_level(rank_idx):
+        level = {}
+        for _ in range(branching):
+            if counter['items'] >= num_items:
+                break
+            counter['nodes'] += 1
+            rank = ranks[rank_idx]
+            name = f'{rank.capitalize()}{counter["nodes"]}'
+            node = {
+                'name': name,
+                'name_zh': random_zh(rng, 3),
+                'key': random_key(rng),
+                'rank': rank,
+            }
+            if rank_idx == len(ranks) - 1:
+                counter['items'] += 1
+                node['name'] = f'Species{counter["items"]}'
+                node['records'] = [{
+                    'is_accepted': '1' if rng.random() < 0.9 else '0',
+                    'status_id': str(rng.randint(1, 4)),
+                    'is_endemic': rng.choice(['0', '1']),
+                    'Chinese_name_other': random_zh(rng, 4),
+                }]
+            else:
+                node['children'] = make_level(rank_idx + 1)
+            level[name] = node
+        return level
+
+    hierarchy = {}
+    # keep adding top-level taxa until all items are generated
+    while counter['items'] < num_items:
+        hierarchy.update(make_level(0))
+    return hierarchy
+
+
+def setup_library(name, ranks):
+    """Library + its settings ini + item type/field 1 used by import_collection."""
+    conf_path = Path('app', 'settings', f'{name}.ini')
+    conf_path.parent.mkdir(exist_ok=True)
+    conf_path.write_text(f'[collection]\nlevels = {",".join(ranks)}\n')
+
+    if not session.get(ItemType, 1):
+        session.add(ItemType(id=1, name='species'))
+    if not session.get(Field, 1):
+        session.add(Field(id=1, name='is_accepted', label='Accepted'))
+    if not session.execute(select(Field).where(Field.name == 'source_data')).scalar():
+        session.add(Field(name='source_data', label='Source'))
+    session.flush()
+    for field in session.execute(select(Field).where(Field.name.in_(['is_accepted', 'source_data']))).scalars():
+        if not session.execute(select(ItemTypeField).where(ItemTypeField.item_type_id == 1, ItemTypeField.field_id == field.id)).scalar():
+            session.add(ItemTypeField(item_type_id=1, field_id=field.id, sort=field.id, control_id=1))
+
+    library = Library(name=name, host=f'{name}.localhost', title=name)
+    session.add(library)
+    session.commit()
+    return library, conf_path
+
+
+def add_notes(library_id, notes_ratio, seed):
+    rng = random.Random(seed)
+    items = session.execute(select(Item.id, Item.name, Item.name_zh).where(Item.library_id == library_id)).all()
+    rows = []
+    for item_id, name, name_zh in items:
+        if rng.random() < notes_ratio:
+            text = ''.join(
+                rng.choice(BBCODE_SNIPPETS).format(name=name, name_zh=name_zh, n=rng.randint(1, 99999))
+                for _ in range(rng.randint(5, 30))
+            )
+            rows.append({'item_id': item_id, 'title': name, 'note': text})
+    if rows:
+        session.execute(insert(ItemNote), rows)
+    session.commit()
+    return len(rows)
+
+
+def drop_library(library_id):
+    item_ids = select(Item.id).where(Item.library_id == library_id)
+    collection_ids = select(Collection.id).where(Collection.library_id == library_id)
+    session.execute(delete(ItemNote).where(ItemNote.item_id.in_(item_ids)))
+    session.execute(delete(ItemData).where(ItemData.item_id.in_(item_ids)))
+    session.execute(delete(CollectionItem).where(CollectionItem.item_id.in_(item_ids)))
+    session.execute(delete(CollectionClosure).where(CollectionClosure.ancestor_id.in_(collection_ids)))
+    session.execute(delete(Item).where(Item.library_id == library_id))
+    session.execute(delete(Collection).where(Collection.library_id == library_id))
+    session.execute(delete(Library).where(Library.id == library_id))
+    session.commit()
+
+
+def measure(func, repeat):
+    times = []
+    for _ in range(repeat):
+        session.expunge_all() # cold identity map every run
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    session.rollback()
+    times.sort()
+    return {
+        'repeat': repeat,
+        'min_ms': round(times[0], 3),
+        'median_ms': round(statistics.median(times), 3),
+        'p95_ms': round(times[min(len(times) - 1, int(len(times) * 0.95))], 3),
+        'mean_ms': round(statistics.fmean(times), 3),
+    }
+
+
+def run_benchmarks(library, repeat):
+    from app.blueprints.frontpage import render_item_detail
+
+    library_id = library.id
+    host = library.host
+    total = get_items(library_id, {}, 1, 0)['total']
+    root_id = session.execute(
+        select(Collection.id).where(Collection.library_id == library_id, Collection.level == RANKS[0]).order_by(Collection.id)
+    ).scalar()
+    sample_ids = session.execute(
+        select(Item.id).where(Item.library_id == library_id).order_by(Item.id).limit(repeat)
+    ).scalars().all()
+    sample = itertools.cycle(sample_ids)
+
+    def render_detail():
+        with flask_app.test_request_context(f'/items/{sample_ids[0]}', headers={'Host': host}):
+            render_item_detail(sample_ids[0])
+
+    benchmarks = {
+        'get_collections': lambda: get_collections(library_id, 2),
+        'get_items': lambda: get_items(library_id, {}, 20, 0),
+        'get_items_search': lambda: get_items(library_id, {'q': 'species1'}, 20, 0),
+        'get_items_collection': lambda: get_items(library_id, {'collection_id': root_id}, 20, 0),
+        'get_items_deep_offset': lambda: get_items(library_id, {}, 20, max(total - 20, 0)),
+        'item_field_data': lambda: session.get(Item, next(sample)).field_data,
+        'item_detail_render': render_detail,
+    }
+    results = {}
+    for name, func in benchmarks.items():
+        print(f'⏱  {name}')
+        results[name] = measure(func, repeat)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(base, results):
+    print(f'\n📊 median vs {base["meta"].get("revision")}:')
+    for name, x in results['benchmarks'].items():
+        if y := base['benchmarks'].get(name):
+            ratio = x['median_ms'] / y['median_ms'] if y['median_ms'] else 0
+            print(f'   {name:<24} {y["median_ms"]:>10.2f} -> {x["median_ms"]:>10.2f} ms  ({ratio:.2f}x)')
+
+
+def positive_int(value):
+    if (x := int(value)) < 1:
+        raise argparse.ArgumentTypeError(f'{value} is not >= 1')
+    return x
+
+
+def create_arg_parser():
+    """Create and configure argument parser."""
+    parser = argparse.ArgumentParser(
+        description='Seed a synthetic library and time the catalog hot paths.',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--items', type=int, default=2000, help='number of species items (default: 2000)')
+    parser.add_argument('--branching', type=positive_int, default=4, help='children per taxon (default: 4)')
+    parser.add_argument('--depth', type=int, default=len(RANKS), help=f'number of ranks, max {len(RANKS)} (default: {len(RANKS)})')
+    parser.add_argument('--notes', type=float, default=0.5, help='ratio of items with a BBCode note (default: 0.5)')
+    parser.add_argument('--repeat', type=int, default=20, help='runs per benchmark (default: 20)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (default: 42)')
+    parser.add_argument('--keep', action='store_true', help='keep the synthetic library')
+    parser.add_argument('-o', '--output', type=str, default='bench.json', help='result JSON (default: bench.json)')
+    parser.add_argument('--compare', type=str, help='previous result JSON to compare with')
+    return parser
+
+
+def main():
+    parser = create_arg_parser()
+    args = parser.parse_args()
+    # top ranks + species
+    ranks = RANKS[:max(args.depth, 2) - 1] + RANKS[-1:]
+
+    name = f'bench-{args.seed}-{args.items}'
+    with flask_app.app_context():
+        print(f'🔨 Generating {args.items} items, ranks: {", ".join(ranks)}')
+        hierarchy = generate_hierarchy(args.items, args.branching, ranks, args.seed)
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False, encoding='utf-8') as f:
+            json.dump(hierarchy, f, ensure_ascii=False)
+            json_file = f.name
+
+        library, conf_path = setup_library(name, ranks)
+        try:
+            print(f'⏱  import_collection (library {library.id})')
+            start = time.perf_counter()
+            import_collection(json_file, library.id)
+            import_ms = (time.perf_counter() - start) * 1000
+            num_notes = add_notes(library.id, args.notes, args.seed)
+
+            benchmarks = {'import_collection': {'repeat': 1, 'min_ms': round(import_ms, 3), 'median_ms': round(import_ms, 3), 'p95_ms': round(import_ms, 3), 'mean_ms': round(import_ms, 3)}}
+            benchmarks.update(run_benchmarks(library, args.repeat))
+        finally:
+            os.unlink(json_file)
+            if not args.keep:
+                session.rollback()
+                drop_library(library.id)
+                conf_path.unlink()
+            session.remove()
+
+    results = {
+        'meta': {
+            'revision': git_revision(),
+            'created_at': datetime.now().isoformat(),
+            'items': args.items,
+            'branching': args.branching,
+            'ranks': ranks,
+            'notes': num_notes,
+            'repeat': args.repeat,
+            'seed': args.seed,
+        },
+        'benchmarks': benchmarks,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f'💾 Results written to: {args.output}')
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()